@@ -0,0 +1,365 @@
+# # Word-Parallel Bit Sets
+
+# chapter03's set methods and chapter04's set operators (`|`, `&`, `-`,
+# `^`) work on hash sets: ~60 bytes per element once the table slot and the
+# int object are counted; chapter04's bitwise section has the same
+# operators on ints, where they work on 30-bit digits at a time, in C
+
+# `BitSet` is a mutable set of non-negative ints, one bit per possible
+# element; for dense ID sets that's 1/8 byte per ID in the range
+# - the bits are stored in an `array('Q')` of 64-bit words, so `add`,
+#   `discard` and `in` touch a single word
+# - set algebra (`|`, `&`, `-`, `^`, their in-place forms, `union`, ...,
+#   `issubset`, `==`, ...) converts the words to a Python int
+#   (`int.from_bytes`), applies the int operator and converts back: a few
+#   linear passes in C instead of one bytecode loop per element
+# - `len` is `int.bit_count` (Python 3.10+) on the whole set
+# - iteration yields the elements in increasing order, skipping zero bytes
+#   with `itertools.compress` and looking the others up in a 256-entry
+#   table of bit positions
+# - it's a `collections.abc.MutableSet`, so the operators also take plain
+#   sets and other iterables of ints (as `frozenset | list` does not)
+# - negative or non-int elements are never members; adding one (`add`,
+#   `|`, `^`, `update`, ...) raises `ValueError` / `TypeError`, while `&`,
+#   `-`, `isdisjoint`, `issubset`, ... just ignore them
+
+import array
+import collections.abc
+import itertools
+import sys
+
+# the positions of the set bits in each byte value
+_BIT_OFFSETS = [tuple(p for p in range(8) if value >> p & 1)
+                for value in range(256)]
+
+
+class BitSet(collections.abc.MutableSet):
+    __slots__ = ("_words",)
+    __hash__ = None  # mutable
+
+    def __init__(self, iterable=()):
+        self._words = array.array("Q")
+        if isinstance(iterable, BitSet):
+            self._words.extend(iterable._words)
+        else:
+            self |= iterable
+
+    @classmethod
+    def _from_int(cls, value):
+        result = cls.__new__(cls)
+        result._words = array.array("Q")
+        result._set_int(value)
+        return result
+
+    @classmethod
+    def _from_iterable(cls, iterable):
+        # used by the `Set` mixins for non-BitSet operands
+        return cls(iterable)
+
+    def _to_int(self):
+        return int.from_bytes(self._words, sys.byteorder)
+
+    def _set_int(self, value):
+        words = array.array("Q")
+        words.frombytes(value.to_bytes(8 * ((value.bit_length() + 63) >> 6),
+                                       sys.byteorder))
+        self._words = words
+
+    @staticmethod
+    def _as_int(other):
+        # the bit pattern of a BitSet or any iterable of non-negative ints
+        if isinstance(other, BitSet):
+            return other._to_int()
+        return BitSet(other)._to_int()
+
+    @staticmethod
+    def _mask_of(other):
+        # the same, for operations that never add elements (`&`, `-`,
+        # `issubset`, ...): what can't be a member is simply not in `self`,
+        # so it's ignored instead of rejected, as `set` would
+        if isinstance(other, BitSet):
+            return other._to_int()
+        result = BitSet()
+        for x in other:
+            if isinstance(x, int) and x >= 0:
+                result.add(x)
+        return result._to_int()
+
+    # ## single elements
+
+    def __contains__(self, x):
+        if x.__class__ is not int and not isinstance(x, int):
+            return False
+        i = x >> 6
+        return 0 <= i < len(self._words) and \
+            (self._words[i] >> (x & 63)) & 1 == 1
+
+    def add(self, x):
+        if not isinstance(x, int):
+            raise TypeError("BitSet elements must be int, not {}".format(
+                type(x).__name__))
+        if x < 0:
+            raise ValueError("BitSet elements must be non-negative")
+        i = x >> 6
+        words = self._words
+        if i >= len(words):
+            words.frombytes(bytes(8 * (i + 1 - len(words))))
+        words[i] |= 1 << (x & 63)
+
+    def discard(self, x):
+        if x in self:
+            self._words[x >> 6] &= ~(1 << (x & 63)) & 0xFFFFFFFFFFFFFFFF
+
+    def pop(self):
+        # removes and returns the smallest element
+        for i, word in enumerate(self._words):
+            if word:
+                low = word & -word
+                self._words[i] = word ^ low
+                return 64 * i + low.bit_length() - 1
+        raise KeyError("pop from an empty BitSet")
+
+    def clear(self):
+        self._words = array.array("Q")
+
+    def copy(self):
+        return BitSet(self)
+
+    def __len__(self):
+        return self._to_int().bit_count()
+
+    def __iter__(self):
+        words = self._words
+        if sys.byteorder == "big":
+            words = array.array("Q", words)
+            words.byteswap()
+        data = words.tobytes()  # little-endian: byte i holds bits 8i..8i+7
+        for i, byte in itertools.compress(enumerate(data), data):
+            base = 8 * i
+            for offset in _BIT_OFFSETS[byte]:
+                yield base + offset
+
+    def __repr__(self):
+        return "BitSet({})".format(list(self))
+
+    # ## set algebra
+
+    def __or__(self, other):
+        if not isinstance(other, collections.abc.Iterable):
+            return NotImplemented
+        return BitSet._from_int(self._to_int() | self._as_int(other))
+
+    def __and__(self, other):
+        if not isinstance(other, collections.abc.Iterable):
+            return NotImplemented
+        return BitSet._from_int(self._to_int() & self._mask_of(other))
+
+    def __sub__(self, other):
+        if not isinstance(other, collections.abc.Iterable):
+            return NotImplemented
+        return BitSet._from_int(self._to_int() & ~self._mask_of(other))
+
+    def __xor__(self, other):
+        if not isinstance(other, collections.abc.Iterable):
+            return NotImplemented
+        return BitSet._from_int(self._to_int() ^ self._as_int(other))
+
+    __ror__ = __or__
+    __rand__ = __and__
+    __rxor__ = __xor__
+
+    def __rsub__(self, other):
+        if not isinstance(other, collections.abc.Iterable):
+            return NotImplemented
+        return BitSet._from_int(self._as_int(other) & ~self._to_int())
+
+    def __ior__(self, other):
+        if isinstance(other, BitSet):
+            self._set_int(self._to_int() | other._to_int())
+        else:
+            for x in other:
+                self.add(x)
+        return self
+
+    def __iand__(self, other):
+        self._set_int(self._to_int() & self._mask_of(other))
+        return self
+
+    def __isub__(self, other):
+        if other is self:
+            self.clear()
+        else:
+            self._set_int(self._to_int() & ~self._mask_of(other))
+        return self
+
+    def __ixor__(self, other):
+        if other is self:
+            self.clear()
+        else:
+            self._set_int(self._to_int() ^ self._as_int(other))
+        return self
+
+    # the named methods take any number of iterables, like `set`'s
+
+    def union(self, *others):
+        value = self._to_int()
+        for other in others:
+            value |= self._as_int(other)
+        return BitSet._from_int(value)
+
+    def intersection(self, *others):
+        value = self._to_int()
+        for other in others:
+            value &= self._mask_of(other)
+        return BitSet._from_int(value)
+
+    def difference(self, *others):
+        value = self._to_int()
+        for other in others:
+            value &= ~self._mask_of(other)
+        return BitSet._from_int(value)
+
+    def symmetric_difference(self, other):
+        return self ^ other
+
+    def update(self, *others):
+        for other in others:
+            self |= other
+
+    def intersection_update(self, *others):
+        self._set_int(self.intersection(*others)._to_int())
+
+    def difference_update(self, *others):
+        self._set_int(self.difference(*others)._to_int())
+
+    def symmetric_difference_update(self, other):
+        self ^= other
+
+    def isdisjoint(self, other):
+        return not self._to_int() & self._mask_of(other)
+
+    def issubset(self, other):
+        return not self._to_int() & ~self._mask_of(other)
+
+    def issuperset(self, other):
+        if not isinstance(other, BitSet):
+            return all(x in self for x in other)
+        return not other._to_int() & ~self._to_int()
+
+    # comparisons only with other sets, as for `set`
+
+    def __eq__(self, other):
+        if isinstance(other, BitSet):
+            return self._to_int() == other._to_int()
+        return super().__eq__(other)
+
+    def __le__(self, other):
+        if isinstance(other, BitSet):
+            return self.issubset(other)
+        return super().__le__(other)
+
+    def __ge__(self, other):
+        if isinstance(other, BitSet):
+            return self.issuperset(other)
+        return super().__ge__(other)
+
+    def __lt__(self, other):
+        if isinstance(other, BitSet):
+            return self != other and self.issubset(other)
+        return super().__lt__(other)
+
+    def __gt__(self, other):
+        if isinstance(other, BitSet):
+            return self != other and self.issuperset(other)
+        return super().__gt__(other)
+
+    def nbytes(self):
+        return self._words.itemsize * len(self._words)
+
+
+# ## Example
+
+
+def set_nbytes(s):
+    # the set plus the int objects it alone keeps alive
+    return sys.getsizeof(s) + sum(sys.getsizeof(x) for x in s if x > 256)
+
+
+def main():
+    import random
+    import timeit
+
+    s = BitSet([1, 3, 5, 7, 11])
+    t = BitSet([1, 3, 6, 9, 12])
+    print(s | t, s & t, s - t, s ^ t, sep="\n")
+    print(len(s), 5 in s, 6 in s, s <= s | t, s.isdisjoint([2, 4]))
+    # >>> BitSet([1, 3, 5, 6, 7, 9, 11, 12])
+    # >>> BitSet([1, 3])
+    # >>> BitSet([5, 7, 11])
+    # >>> BitSet([5, 6, 7, 9, 11, 12])
+    # >>> 5 True False True True
+
+    # consistency against set
+    rnd = random.Random(47)
+    for _ in range(200):
+        a = {rnd.randrange(300) for _ in range(rnd.randrange(60))}
+        b = {rnd.randrange(300) for _ in range(rnd.randrange(60))}
+        ba, bb = BitSet(a), BitSet(b)
+        for op in ("__or__", "__and__", "__sub__", "__xor__"):
+            assert set(getattr(ba, op)(bb)) == getattr(a, op)(b)
+            assert set(getattr(ba, op)(b)) == getattr(a, op)(b)
+        assert list(ba) == sorted(a) and len(ba) == len(a)
+        assert (ba <= bb) == (a <= b) and (ba < bb) == (a < b)
+        assert (ba == bb) == (a == b) and ba.isdisjoint(bb) == a.isdisjoint(b)
+        x = rnd.randrange(300)
+        ba.discard(x)
+        a.discard(x)
+        assert ba == BitSet(a) and set(ba) == a
+
+    n = 10000000
+    ids = [i for i in range(n) if rnd.random() < 0.5]
+    others = [i for i in range(n) if rnd.random() < 0.5]
+    sa, sb = set(ids), set(others)
+    ba, bb = BitSet(ids), BitSet(others)
+    print("~{:,} of {:,} ids".format(len(ids), n))
+    print("bytes/element: set {:.1f}, BitSet {:.3f}".format(
+        set_nbytes(sa) / len(sa), ba.nbytes() / len(ba)))
+    # >>> ~4,996,820 of 10,000,000 ids
+    # >>> bytes/element: set 54.9, BitSet 0.250
+
+    probe = rnd.sample(range(n), 100000)
+    rows = (
+        ("a | b", lambda: sa | sb, lambda: ba | bb),
+        ("a & b", lambda: sa & sb, lambda: ba & bb),
+        ("a - b", lambda: sa - sb, lambda: ba - bb),
+        ("a ^ b", lambda: sa ^ sb, lambda: ba ^ bb),
+        ("len(a)", lambda: len(sa), lambda: len(ba)),
+        ("sorted(a) / list(a)", lambda: sorted(sa), lambda: list(ba)),
+        ("100k x in", lambda: [x in sa for x in probe],
+         lambda: [x in ba for x in probe]),
+        ("100k add", lambda: [sa.add(x) for x in probe],
+         lambda: [ba.add(x) for x in probe]),
+    )
+    print("seconds:               set       BitSet")
+    for label, with_set, with_bits in rows:
+        t_set = min(timeit.repeat(with_set, number=1, repeat=3))
+        t_bits = min(timeit.repeat(with_bits, number=1, repeat=3))
+        print("{:<20} {:>8.4f} {:>12.4f}".format(label, t_set, t_bits))
+    # >>> seconds:               set       BitSet
+    # >>> a | b                  0.3527       0.0040
+    # >>> a & b                  0.3064       0.0035
+    # >>> a - b                  0.2972       0.0040
+    # >>> a ^ b                  0.3679       0.0038
+    # >>> len(a)                 0.0000       0.0018
+    # >>> sorted(a) / list(a)    0.2247       0.3868
+    # >>> 100k x in              0.0224       0.0291
+    # >>> 100k add               0.0206       0.0308
+
+    # ~220x less memory and ~80-100x faster set algebra at 50% density;
+    # single-element operations are Python methods, so they're ~1.5x slower
+    # than `set`'s, and iterating costs a bytecode step per element (still
+    # sorted for free); below ~1/400 density a `set` is smaller
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+# # A Memory Observatory: Census, Diffs and Referrer Chains
+
+# chapter03's `print_a_refs` watches one object's reference count, and the
+# notes show `q` and `r` referring to each other so that `del` doesn't free
+# them; in a long-running process the question is usually "what is growing,
+# and who is holding it?"
+
+# - `census()` walks every object the cyclic collector tracks
+#   (`gc.get_objects()`) and returns `{type name: [count, bytes]}`
+#   - bytes: `sys.getsizeof` of the object plus the objects it refers to
+#     that the collector doesn't track (`str`, `int`, `float`, `bytes`, ...;
+#     those never show up in `gc.get_objects()` on their own); an untracked
+#     object shared by several containers is counted once per container, so
+#     treat the size as an upper bound
+#   - the walk goes one generation at a time and only keeps per-type totals:
+#     memory use is the list `gc.get_objects(generation)` returns (8 bytes
+#     per object, about twice that at peak while the list grows) plus one
+#     entry per type, not per object
+# - `Snapshot` wraps one census; `new.diff(old)` lists the types that grew
+# - `referrer_chain(obj)` walks `gc.get_referrers` backwards from an object
+#   until it reaches a module and returns a readable path, e.g.
+#   `module __main__ .registry [2] .peer Node`
+#   - every step rescans the heap, so keep `max_depth` small on big heaps
+# - `deep_size(obj)` is the recursive size of one object graph
+
+import gc
+import sys
+import types
+
+_UNTRACKED_LIMIT = 1000  # referents checked per object, for huge containers
+
+
+def _type_name(t):
+    if t.__module__ == "builtins":
+        return t.__qualname__
+    return "{}.{}".format(t.__module__, t.__qualname__)
+
+
+def census(generations=(0, 1, 2)):
+    totals = {}
+    getsizeof = sys.getsizeof
+    is_tracked = gc.is_tracked
+    get_referents = gc.get_referents
+    for generation in generations:
+        objects = gc.get_objects(generation)
+        for obj in objects:
+            size = getsizeof(obj)
+            referents = get_referents(obj)
+            if len(referents) <= _UNTRACKED_LIMIT:
+                for child in referents:
+                    if not is_tracked(child) and \
+                            child.__class__ is not type:
+                        size += getsizeof(child)
+            entry = totals.get(obj.__class__)
+            if entry is None:
+                totals[obj.__class__] = [1, size]
+            else:
+                entry[0] += 1
+                entry[1] += size
+        del objects
+    return {_type_name(t): v for t, v in totals.items()}
+
+
+class Snapshot:
+    def __init__(self, totals=None):
+        self.totals = census() if totals is None else totals
+
+    def top(self, limit=10, by="bytes"):
+        index = 1 if by == "bytes" else 0
+        return sorted(self.totals.items(), key=lambda kv: kv[1][index],
+                      reverse=True)[:limit]
+
+    def diff(self, old, limit=10):
+        # [(type name, count delta, bytes delta)] for types that grew most
+        rows = []
+        for name, (count, size) in self.totals.items():
+            old_count, old_size = old.totals.get(name, (0, 0))
+            if count != old_count or size != old_size:
+                rows.append((name, count - old_count, size - old_size))
+        rows.sort(key=lambda r: r[2], reverse=True)
+        return rows[:limit]
+
+    @staticmethod
+    def format(rows, header=("type", "count", "bytes")):
+        lines = ["{:<28} {:>10} {:>12}".format(*header)]
+        for name, count, size in rows:
+            lines.append("{:<28} {:>+10} {:>+12}".format(
+                name[-28:], count, size))
+        return "\n".join(lines)
+
+
+def deep_size(obj):
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, (type, types.ModuleType)):
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        stack.extend(gc.get_referents(o))
+    return total
+
+
+def _edge(parent, child):
+    # how `parent` refers to `child`, as a short label
+    if isinstance(parent, types.ModuleType):
+        return "module {}".format(parent.__name__)
+    if isinstance(parent, dict):
+        for k, v in parent.items():
+            if v is child:
+                return "[{!r}]".format(k) if not isinstance(k, str) \
+                    else ".{}".format(k)
+            if k is child:
+                return "key"
+        return "dict"
+    if isinstance(parent, (list, tuple)):
+        for i, v in enumerate(parent):
+            if v is child:
+                return "[{}]".format(i)
+    for name in getattr(type(parent), "__slots__", ()):
+        if getattr(parent, name, None) is child:
+            return ".{}".format(name)
+    d = getattr(parent, "__dict__", None)
+    if isinstance(d, dict):
+        for k, v in d.items():
+            if v is child:
+                return ".{}".format(k)
+    return _type_name(type(parent))
+
+
+def referrer_chain(obj, max_depth=12):
+    # breadth first from `obj` towards a module; returns a list of labels
+    # from the module down to `obj`, or None if no module is reached
+    gc.collect()
+    frame = sys._getframe()
+    parents = {id(obj): None}
+    keep = [obj]  # holds every visited object alive while we search
+    level = [obj]
+    ignore = {id(parents), id(keep), id(frame)}
+    for _ in range(max_depth):
+        ignore.add(id(level))
+        next_level = []
+        ignore.add(id(next_level))
+        for child in level:
+            referrers = gc.get_referrers(child)
+            ignore.add(id(referrers))
+            for ref in referrers:
+                if id(ref) in ignore or id(ref) in parents or \
+                        isinstance(ref, types.FrameType):
+                    continue
+                parents[id(ref)] = child
+                keep.append(ref)
+                # a module's namespace dict counts as the module
+                if isinstance(ref, types.ModuleType) or (
+                        isinstance(ref, dict) and "__name__" in ref and
+                        sys.modules.get(ref["__name__"]) is not None and
+                        sys.modules[ref["__name__"]].__dict__ is ref):
+                    return _chain(ref, parents)
+                next_level.append(ref)
+        level = next_level
+        if not level:
+            break
+    return None
+
+
+def _chain(root, parents):
+    if isinstance(root, dict):
+        labels = ["module {}".format(root["__name__"])]
+    else:
+        labels = []
+    node = root
+    while parents[id(node)] is not None:
+        child = parents[id(node)]
+        labels.append(_edge(node, child))
+        node = child
+    labels.append(_type_name(type(node)))
+    return labels
+
+
+# ## Example (chapter03's `q` / `r` cycle, now leaking into a registry)
+
+
+class Node:
+    def __init__(self, name):
+        self.name = name
+        self.peer = None
+        self.payload = name * 20
+
+
+registry = []
+
+
+def handle_request(i):
+    # every "request" leaves a pair of nodes behind in `registry`
+    q, r = Node("q{}".format(i)), Node("r{}".format(i))
+    q.peer, r.peer = r, q
+    registry.append(q)
+
+
+def main():
+    import time
+    import tracemalloc
+
+    before = Snapshot()
+    for i in range(5000):
+        handle_request(i)
+    after = Snapshot()
+    print(Snapshot.format(after.diff(before, limit=4)))
+    # >>> type                              count        bytes
+    # >>> __main__.Node                    +10000     +2543380
+    # >>> list                                +51       +48352
+    # >>> dict                                 -1        +1154
+    # >>> __main__.Snapshot                    +1          +56
+
+    leaked = registry[2].peer
+    print(" ".join(referrer_chain(leaked)))
+    # >>> module __main__ .registry [2] .peer __main__.Node
+
+    print(deep_size(registry[0]))
+    # >>> 392
+
+    # a heap of ~2M tracked objects; peak memory of the census itself
+    # (timed without tracemalloc, which slows the walk down a lot)
+    heap = [[i] for i in range(2000000)]
+    start = time.perf_counter()
+    totals = census()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    census()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    objects = sum(count for count, _ in totals.values())
+    print("{:,} objects, {} types: {:.2f}s, peak {:.1f} MB".format(
+        objects, len(totals), elapsed, peak / 1e6))
+    del heap
+    # >>> 2,017,105 objects, 52 types: 2.33s, peak 34.3 MB
+
+    # the peak is the 2M-entry list from `gc.get_objects(2)` while it grows,
+    # not the census: the totals are 52 entries however large the heap
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+# # External and Parallel Sorting
+
+# chapter03 sorts in place with `a.sort(key=strange_sort, reverse=True)`;
+# that needs the whole list in memory, and calls `strange_sort` (a Python
+# function) once per item on one core
+
+# `external_sort(records, key=..., reverse=...)` returns an iterator over
+# the records in the same order `sorted()` would give, without holding them
+# all in memory:
+# - the input is read in runs of `run_size` records
+# - `key` is called exactly once per record: each run becomes a list of
+#   `(key, record)` pairs, sorted with `operator.itemgetter(0)` as the key,
+#   so the comparisons never call back into Python (and never compare the
+#   records themselves when keys are equal)
+# - with `workers > 1`, runs are keyed and sorted in a process pool (the
+#   key function and the records must be picklable; a lambda isn't); at
+#   most `2 * workers` runs are in flight, so memory stays bounded
+# - each sorted run is spilled to a temporary file as a stream of pickled
+#   blocks of `_BLOCK` pairs, and read back a block at a time
+# - `heapq.merge` merges the runs, again keyed with `itemgetter(0)`
+# - a single run never touches the disk, and is just `list.sort`
+# - stability: runs are contiguous slices of the input, each run is sorted
+#   with the stable `list.sort`, and `heapq.merge` resolves ties in favour
+#   of the earlier input; so equal keys keep their input order, for
+#   `reverse=True` too, exactly like `list.sort`
+
+import concurrent.futures
+import heapq
+import itertools
+import multiprocessing
+import operator
+import os
+import pickle
+import shutil
+import tempfile
+
+_BLOCK = 4096  # pairs per pickled block in a run file
+_first = operator.itemgetter(0)
+_second = operator.itemgetter(1)
+
+
+def _sort_run(records, key, reverse):
+    if key is None:
+        records.sort(reverse=reverse)
+        return records
+    pairs = list(zip(map(key, records), records))
+    pairs.sort(key=_first, reverse=reverse)
+    return pairs
+
+
+def _spill(items, path):
+    with open(path, "wb") as f:
+        for i in range(0, len(items), _BLOCK):
+            pickle.dump(items[i:i + _BLOCK], f, pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def _sort_and_spill(records, key, reverse, path):
+    # runs in a worker process
+    return _spill(_sort_run(records, key, reverse), path)
+
+
+def _read_run(path):
+    with open(path, "rb") as f:
+        while True:
+            try:
+                block = pickle.load(f)
+            except EOFError:
+                return
+            yield from block
+
+
+def _runs(iterable, run_size):
+    it = iter(iterable)
+    while True:
+        run = list(itertools.islice(it, run_size))
+        if not run:
+            return
+        yield run
+
+
+def external_sort(iterable, key=None, reverse=False, run_size=1000000,
+                  workers=1, tmpdir=None):
+    runs = _runs(iterable, run_size)
+    first = next(runs, [])
+    second = next(runs, None)
+    if second is None:
+        # fits in one run: plain in-memory sort, which already calls `key`
+        # once per record
+        first.sort(key=key, reverse=reverse)
+        return iter(first)
+    return _merge_runs(itertools.chain((first, second), runs), key, reverse,
+                       workers, tmpdir)
+
+
+def _merge_runs(runs, key, reverse, workers, tmpdir):
+    directory = tempfile.mkdtemp(prefix="extsort-", dir=tmpdir)
+    try:
+        paths = (os.path.join(directory, "run{}".format(i))
+                 for i in itertools.count())
+        if workers > 1:
+            files = _spill_parallel(runs, key, reverse, workers, paths)
+        else:
+            files = [_sort_and_spill(run, key, reverse, path)
+                     for run, path in zip(runs, paths)]
+        merged = heapq.merge(*map(_read_run, files),
+                             key=None if key is None else _first,
+                             reverse=reverse)
+        if key is None:
+            yield from merged
+        else:
+            yield from map(_second, merged)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _spill_parallel(runs, key, reverse, workers, paths):
+    files = []
+    pending = []
+    # "spawn": forked workers would share the parent's (possibly huge) heap
+    # copy-on-write, and end up copying it as reference counts change
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(workers, context) as pool:
+        for run, path in zip(runs, paths):
+            if len(pending) >= 2 * workers:
+                files.append(pending.pop(0).result())
+            pending.append(pool.submit(_sort_and_spill, run, key, reverse,
+                                       path))
+        files.extend(f.result() for f in pending)
+    # in submission order: the merge relies on it for stability
+    return files
+
+
+# ## Example
+
+
+def strange_sort(x):
+    if (x <= 3):
+        return x
+    else:
+        return -x
+
+
+def parse_key(line):
+    # "user-<id>,<country>,<score>" -> (country, -score), a typical
+    # Python-level key
+    _, country, score = line.split(",")
+    return country, -int(score)
+
+
+def main():
+    import random
+    import time
+
+    a = [5, 1, 3, 99, 2, 4, 3]
+    print(list(external_sort(a, key=strange_sort, reverse=True, run_size=2)))
+    print(sorted(a, key=strange_sort, reverse=True))
+    # >>> [3, 3, 2, 1, 4, 5, 99]
+    # >>> [3, 3, 2, 1, 4, 5, 99]
+
+    # stability, both directions: only the first field is the key
+    rnd = random.Random(45)
+    pairs = [(rnd.randrange(10), i) for i in range(10000)]
+    for reverse in (False, True):
+        assert list(external_sort(pairs, key=_first, reverse=reverse,
+                                  run_size=777)) == \
+            sorted(pairs, key=_first, reverse=reverse)
+
+    n = 2000000
+    lines = ["user-{},{},{}".format(i, rnd.choice("ABCDEFGH"),
+                                    rnd.randrange(100000))
+             for i in range(n)]
+    expected = None
+    print("{:,} records, {} cpu(s)".format(n, os.cpu_count()))
+    for label, func in (
+            ("sorted()", lambda: sorted(lines, key=parse_key)),
+            ("external, 1 run",
+             lambda: list(external_sort(lines, key=parse_key,
+                                        run_size=n))),
+            ("external, 8 runs",
+             lambda: list(external_sort(lines, key=parse_key,
+                                        run_size=n // 8))),
+            ("external, 8 runs, 2 workers",
+             lambda: list(external_sort(lines, key=parse_key,
+                                        run_size=n // 8, workers=2)))):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        expected = expected or result
+        assert result == expected
+        print("{:<28} {:>6.2f}s".format(label, elapsed), flush=True)
+    # >>> 2,000,000 records, 1 cpu(s)
+    # >>> sorted()                       5.28s
+    # >>> external, 1 run                5.63s
+    # >>> external, 8 runs              18.76s
+    # >>> external, 8 runs, 2 workers   12.90s
+    # (one core: the pool only overlaps pickling with sorting; the merge
+    # is single-threaded and dominates; the point is bounded memory, not
+    # beating `sorted()` when the data fits)
+
+
+if __name__ == '__main__':
+    main()
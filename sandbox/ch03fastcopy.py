@@ -0,0 +1,156 @@
+# # Fast Deep Copies of JSON-shaped Data
+
+# chapter03 copies `a = [1, 2, [3, 4]]` with `copy.deepcopy`; deepcopy
+# handles any object, and pays for it on every node: a `memo` dict entry
+# (so shared and cyclic references come out right), a lookup of the copier
+# for the type, and a `__deepcopy__` / `__reduce_ex__` check for others
+
+# request payloads, configs and the like are trees of dict / list / tuple /
+# str / int / float / bool / None; `fastcopy(obj)` copies those directly:
+# - immutable leaves (str, int, float, bool, None, bytes) are returned as
+#   they are, without a function call per element
+# - dicts and lists are copied with `dict.copy()` / `list[:]` (in C), then
+#   only the values that are containers get replaced by their copies; a
+#   tuple is rebuilt only when something inside it had to be copied
+# - anything else (a `set`, a `datetime`, your own class) is handed to
+#   `copy.deepcopy`
+# - cycles: by default the containers on the current path are tracked by
+#   `id()`; on finding one, the whole copy is redone with `copy.deepcopy`
+#   (which reproduces the cycle); `fastcopy(obj, acyclic=True)` drops that
+#   tracking when the data is known to be a tree
+# - unlike deepcopy, an object that appears twice in the input (but not as
+#   a cycle) is copied twice, so the copy doesn't share it
+
+import copy
+
+_ATOMIC = frozenset((str, int, float, bool, type(None), bytes, complex))
+
+
+class _Cycle(Exception):
+    pass
+
+
+def _copy_tree(obj):
+    # copy the container in C, then replace only the values that aren't
+    # immutable leaves
+    cls = obj.__class__
+    if cls is dict:
+        new = obj.copy()
+        for k, v in obj.items():
+            if v.__class__ not in _ATOMIC:
+                new[k] = _copy_tree(v)
+        return new
+    if cls is list:
+        new = obj[:]
+        for i, v in enumerate(obj):
+            if v.__class__ not in _ATOMIC:
+                new[i] = _copy_tree(v)
+        return new
+    if cls is tuple:
+        return _copy_tuple(obj, _copy_tree(list(obj)))
+    if cls in _ATOMIC:
+        return obj
+    return copy.deepcopy(obj)
+
+
+def _copy_checked(obj, active):
+    cls = obj.__class__
+    if cls is dict or cls is list or cls is tuple:
+        key = id(obj)
+        if key in active:
+            raise _Cycle
+        active.add(key)
+        if cls is dict:
+            new = obj.copy()
+            for k, v in obj.items():
+                if v.__class__ not in _ATOMIC:
+                    new[k] = _copy_checked(v, active)
+        else:
+            new = list(obj)
+            for i, v in enumerate(obj):
+                if v.__class__ not in _ATOMIC:
+                    new[i] = _copy_checked(v, active)
+            if cls is tuple:
+                new = _copy_tuple(obj, new)
+        active.discard(key)
+        return new
+    if cls in _ATOMIC:
+        return obj
+    return copy.deepcopy(obj)
+
+
+def _copy_tuple(old, items):
+    # keep the original tuple when nothing inside it needed copying
+    if all(a is b for a, b in zip(items, old)):
+        return old
+    return tuple(items)
+
+
+def fastcopy(obj, acyclic=False):
+    if acyclic:
+        return _copy_tree(obj)
+    try:
+        return _copy_checked(obj, set())
+    except _Cycle:
+        return copy.deepcopy(obj)
+
+
+def main():
+    import marshal
+    import pickle
+    import random
+    import timeit
+
+    a = [1, 2, [3, 4]]
+    b = fastcopy(a)
+    b[2][1] = 43
+    print("a: {}".format(a))
+    print("b: {}".format(b))
+    # >>> a: [1, 2, [3, 4]]
+    # >>> b: [1, 2, [3, 43]]
+
+    cyclic = {"name": "loop", "children": []}
+    cyclic["children"].append(cyclic)
+    c = fastcopy(cyclic)
+    print(c["children"][0] is c, c is not cyclic)
+    # >>> True True
+
+    # 2,000 "orders", as a JSON API would return them
+    rnd = random.Random(43)
+    data = [{
+        "id": i,
+        "customer": {"name": "customer {}".format(rnd.randrange(500)),
+                     "email": "c{}@example.com".format(i),
+                     "vip": rnd.random() < 0.1},
+        "lines": [{"sku": "SKU-{}".format(rnd.randrange(10000)),
+                   "qty": rnd.randrange(1, 5),
+                   "price": round(rnd.uniform(1, 100), 2)}
+                  for _ in range(rnd.randrange(1, 8))],
+        "tags": ["gift", "express"][:rnd.randrange(3)],
+        "note": None,
+    } for i in range(2000)]
+    assert fastcopy(data) == data == fastcopy(data, acyclic=True)
+
+    n = 5
+    for label, func in (
+            ("copy.deepcopy", copy.deepcopy),
+            ("pickle round-trip",
+             lambda d: pickle.loads(pickle.dumps(d, -1))),
+            ("marshal round-trip", lambda d: marshal.loads(marshal.dumps(d))),
+            ("fastcopy", fastcopy),
+            ("fastcopy(acyclic=True)", lambda d: fastcopy(d, acyclic=True))):
+        t = min(timeit.repeat(lambda: func(data), number=n, repeat=15)) / n
+        print("{:<24} {:>7.2f} ms".format(label, t * 1e3))
+    # >>> copy.deepcopy              28.17 ms
+    # >>> pickle round-trip           7.22 ms
+    # >>> marshal round-trip          4.63 ms
+    # >>> fastcopy                    9.06 ms
+    # >>> fastcopy(acyclic=True)      7.03 ms
+
+    # ~3-4x faster than deepcopy, and about as fast as a pickle round-trip
+    # without needing the data to be picklable; marshal, all C, is faster
+    # still when the data holds nothing but builtin types
+
+
+if __name__ == '__main__':
+    main()
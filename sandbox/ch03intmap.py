@@ -0,0 +1,298 @@
+# # Compact Integer-Keyed Hash Map
+
+# chapter03's dict section: a dict is Python's hash table and takes any
+# immutable key; the price of that generality is ~100 bytes per int->int
+# entry (a 24-byte table slot plus sparse index, and a 28-byte int object
+# for every key and value outside the small-int cache, 24 for a float)
+
+# `IntMap` only stores 64-bit ints as keys and either 64-bit ints
+# (`typecode="q"`, the default) or doubles (`typecode="d"`) as values, as
+# raw machine words:
+# - open addressing with linear probing over three parallel buffers: keys
+#   and values in `array.array`s, and a `bytearray` of slot states (empty,
+#   full, deleted)
+# - the slot for a key is the top bits of `key * 0x9E3779B97F4A7C15` (mod
+#   2**64), Fibonacci hashing, so runs of consecutive keys spread out
+# - the table doubles at 2/3 load (counting deleted slots), so an entry
+#   costs 17 bytes / load, i.e. 26-51 bytes
+# - it's a `MutableMapping`: `m[k]`, `m[k] = v`, `del m[k]`, `in`, `len`,
+#   iteration, `get`, `items()`, `update()`, ...; `iter_items()` and
+#   `iter_values()` are one-shot iterators that scan the buffers directly
+# - `update_from_arrays(keys, values)` inserts in bulk after sizing the
+#   table once; `get_many(keys, default)` returns an `array` of values
+# - non-int keys are never present (`KeyError`); storing one is a
+#   `TypeError`, and ints that don't fit 64 bits raise `OverflowError`
+#   from `array`, like `array('q', [2**63])`
+
+import array
+import collections.abc
+import itertools
+
+_EMPTY, _FULL, _DELETED = 0, 1, 2
+_ONLY_FULL = bytes([0, 1, 0]) + bytes(253)  # bytes.translate table
+_MULT = 0x9E3779B97F4A7C15
+_MASK64 = (1 << 64) - 1
+_MIN_BITS = 3
+
+
+class IntMap(collections.abc.MutableMapping):
+    __slots__ = ("_keys", "_values", "_states", "_len", "_fill", "_mask",
+                 "_shift", "_typecode")
+
+    def __init__(self, other=(), typecode="q"):
+        if typecode not in ("q", "d"):
+            raise ValueError("typecode must be 'q' or 'd'")
+        self._typecode = typecode
+        self._allocate(_MIN_BITS)
+        self.update(other)
+
+    def _allocate(self, bits):
+        size = 1 << bits
+        self._keys = array.array("q", bytes(8 * size))
+        self._values = array.array(self._typecode, bytes(8 * size))
+        self._states = bytearray(size)
+        self._len = self._fill = 0
+        self._mask = size - 1
+        self._shift = 64 - bits
+
+    def _resize(self, minimum):
+        # rehash the live entries into a table that holds `minimum` of
+        # them below 2/3 load
+        bits = _MIN_BITS
+        while (1 << bits) * 2 < 3 * minimum:
+            bits += 1
+        full = self._states.translate(_ONLY_FULL)
+        keys = list(itertools.compress(self._keys, full))
+        values = list(itertools.compress(self._values, full))
+        self._allocate(bits)
+        self._insert_all(keys, values)
+
+    def _find(self, key):
+        # slot index holding `key`, or -1
+        mask = self._mask
+        i = ((key * _MULT) & _MASK64) >> self._shift
+        keys = self._keys
+        states = self._states
+        while True:
+            state = states[i]
+            if state == _EMPTY:
+                return -1
+            if state == _FULL and keys[i] == key:
+                return i
+            i = (i + 1) & mask
+
+    def _insert_all(self, keys, values):
+        # the hot loop for resizes and bulk updates; assumes enough room
+        mask = self._mask
+        shift = self._shift
+        table_keys = self._keys
+        table_values = self._values
+        states = self._states
+        for key, value in zip(keys, values):
+            i = ((key * _MULT) & _MASK64) >> shift
+            free = -1
+            while True:
+                state = states[i]
+                if state == _EMPTY:
+                    break
+                if state == _FULL:
+                    if table_keys[i] == key:
+                        break
+                elif free < 0:
+                    free = i
+                i = (i + 1) & mask
+            if state == _FULL:
+                table_values[i] = value
+                continue
+            if free >= 0:
+                i = free  # reuse a deleted slot; fill is unchanged
+            else:
+                self._fill += 1
+            table_keys[i] = key
+            table_values[i] = value
+            states[i] = _FULL
+            self._len += 1
+
+    def __getitem__(self, key):
+        if key.__class__ is not int and not isinstance(key, int):
+            raise KeyError(key)
+        i = self._find(key)
+        if i < 0:
+            raise KeyError(key)
+        return self._values[i]
+
+    def __setitem__(self, key, value):
+        if not isinstance(key, int):
+            raise TypeError("IntMap keys must be int, not {}".format(
+                type(key).__name__))
+        if 3 * (self._fill + 1) > 2 * (self._mask + 1):
+            self._resize(self._len + 1)
+        self._insert_all((key,), (value,))
+
+    def __delitem__(self, key):
+        i = self._find(key) if isinstance(key, int) else -1
+        if i < 0:
+            raise KeyError(key)
+        self._states[i] = _DELETED
+        self._len -= 1
+
+    def __contains__(self, key):
+        return isinstance(key, int) and self._find(key) >= 0
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return itertools.compress(self._keys,
+                                  self._states.translate(_ONLY_FULL))
+
+    # one pass over the buffers with no lookups; `items()` and `values()`
+    # stay the `MutableMapping` views, which probe once per key
+
+    def iter_items(self):
+        full = self._states.translate(_ONLY_FULL)
+        return zip(itertools.compress(self._keys, full),
+                   itertools.compress(self._values, full))
+
+    def iter_values(self):
+        return itertools.compress(self._values,
+                                  self._states.translate(_ONLY_FULL))
+
+    def clear(self):
+        self._allocate(_MIN_BITS)
+
+    def update_from_arrays(self, keys, values):
+        # `keys` and `values` are sequences of equal length (arrays,
+        # lists, ...); later duplicates win, as with `dict.update`
+        if len(keys) != len(values):
+            raise ValueError("keys and values differ in length")
+        if 3 * (self._fill + len(keys)) > 2 * (self._mask + 1):
+            self._resize(self._len + len(keys))
+        for key in keys:
+            if not isinstance(key, int):
+                raise TypeError("IntMap keys must be int, not {}".format(
+                    type(key).__name__))
+        self._insert_all(keys, values)
+
+    def get_many(self, keys, default=0):
+        # `array` of the values for `keys`, `default` for missing ones
+        mask = self._mask
+        shift = self._shift
+        table_keys = self._keys
+        table_values = self._values
+        states = self._states
+        out = array.array(self._typecode, bytes(8 * len(keys)))
+        for n, key in enumerate(keys):
+            i = ((key * _MULT) & _MASK64) >> shift
+            while True:
+                state = states[i]
+                if state == _EMPTY:
+                    out[n] = default
+                    break
+                if state == _FULL and table_keys[i] == key:
+                    out[n] = table_values[i]
+                    break
+                i = (i + 1) & mask
+        return out
+
+    def nbytes(self):
+        # size of the three buffers
+        return (self._keys.itemsize + self._values.itemsize + 1) * \
+            (self._mask + 1)
+
+    def __repr__(self):
+        return "IntMap({{{}}}, typecode={!r})".format(
+            ", ".join("{}: {}".format(k, v) for k, v in self.iter_items()),
+            self._typecode)
+
+
+# ## Example
+
+
+def dict_nbytes(d):
+    # the dict plus the int/float objects it alone keeps alive (small ints
+    # are shared by the interpreter)
+    import sys
+    size = sys.getsizeof(d)
+    for k, v in d.items():
+        if not -5 <= k <= 256:
+            size += sys.getsizeof(k)
+        if v.__class__ is float or not -5 <= v <= 256:
+            size += sys.getsizeof(v)
+    return size
+
+
+def main():
+    import random
+    import timeit
+
+    m = IntMap({1: 10, 2: 20})
+    m[-3] = 30
+    del m[1]
+    print(m, 2 in m, "2" in m, m.get(7, -1))
+    # >>> IntMap({2: 20, -3: 30}, typecode='q') True False -1
+
+    # consistency against dict, with deletes and re-inserts
+    rnd = random.Random(46)
+    d, m = {}, IntMap(typecode="d")
+    for _ in range(50000):
+        k = rnd.randrange(-2000, 2000)
+        if rnd.random() < 0.4 and k in d:
+            del d[k]
+            del m[k]
+        else:
+            d[k] = m[k] = rnd.random()
+    assert dict(m.items()) == d and len(m) == len(d) and set(m) == set(d)
+    assert dict(m.iter_items()) == d and len(m.items()) == len(d)
+    assert list(m.get_many(range(-2100, 2100), -1.0)) == \
+        [d.get(k, -1.0) for k in range(-2100, 2100)]
+
+    n = 1000000
+    keys = array.array("q", rnd.sample(range(10 * n), n))
+    ints = array.array("q", (rnd.randrange(1 << 40) for _ in range(n)))
+    floats = array.array("d", (rnd.random() for _ in range(n)))
+    probe = [rnd.choice(keys) for _ in range(100000)]
+
+    print("{:,} entries".format(n))
+    for label, values, typecode in (("int->int", ints, "q"),
+                                    ("int->float", floats, "d")):
+        d = dict(zip(keys, values))
+        m = IntMap(typecode=typecode)
+        m.update_from_arrays(keys, values)
+        assert m.get_many(probe).tolist() == [d[k] for k in probe]
+        print("{:<10} bytes/entry: dict {:.1f}, IntMap {:.1f}".format(
+            label, dict_nbytes(d) / n, m.nbytes() / n))
+    # >>> 1,000,000 entries
+    # >>> int->int   bytes/entry: dict 101.9, IntMap 35.7
+    # >>> int->float bytes/entry: dict 93.9, IntMap 35.7
+
+    rows = (
+        ("dict(zip())", lambda: dict(zip(keys, ints)), n),
+        ("update_from_arrays",
+         lambda: IntMap().update_from_arrays(keys, ints), n),
+        ("dict[k]", lambda: [d[k] for k in probe], len(probe)),
+        ("IntMap[k]", lambda: [m[k] for k in probe], len(probe)),
+        ("IntMap.get_many", lambda: m.get_many(probe), len(probe)),
+    )
+    d = dict(zip(keys, ints))
+    m = IntMap()
+    m.update_from_arrays(keys, ints)
+    print("operations per second")
+    for label, stmt, count in rows:
+        t = min(timeit.repeat(stmt, number=1, repeat=3))
+        print("{:<20} {:>12,.0f}".format(label, count / t))
+    # >>> operations per second
+    # >>> dict(zip())             3,600,905
+    # >>> update_from_arrays      1,381,315
+    # >>> dict[k]                 1,664,575
+    # >>> IntMap[k]                 942,731
+    # >>> IntMap.get_many         1,085,292
+
+    # ~2.8x less memory (the table is 1M entries in 2**21 slots, 48% full;
+    # right after a doubling it's ~26 bytes/entry); probing is Python
+    # bytecode, so lookups run at about half dict speed and bulk loads at
+    # ~40%
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,512 @@
+# # Persistent Map and Vector with Structural Sharing
+
+# chapter03's "references and copies" notes: a shallow copy shares the
+# nested mutables, a deep copy duplicates everything; copying a big config
+# or state snapshot defensively on every request costs O(n) each time
+
+# persistent structures never change once built; an "update" returns a new
+# version that shares everything but the O(log n) nodes on the changed path
+# with the old one, so keeping (or handing out) old versions is free
+
+# `PMap`: a hash array mapped trie (HAMT), like `immutables.Map` or
+# Clojure's maps
+# - each node covers 5 bits of the key's hash: a 32-bit `bitmap` says which
+#   of the 32 slots are used, and `items` holds only those, as a flat
+#   `[key, value, key, value, ...]` list; a slot holding a sub-node has the
+#   `_NODE` marker as its key
+# - a slot's position in `items` is the number of bits set below it in the
+#   bitmap (`int.bit_count`, Python 3.10+)
+# - keys whose 64-bit hashes are identical end up in a `_Collision` node
+# - `m.set(k, v)`, `m.delete(k)`, `m.update(mapping)` return new maps;
+#   it's a read-only `Mapping` otherwise (`m[k]`, `in`, `len`, iteration)
+# - `PMap(d)` builds from a dict in one pass, mutating the fresh nodes in
+#   place (nobody else can see them yet); `m.todict()` converts back in one
+#   walk (`dict(m)` works too, with a lookup per key)
+
+# `PVector`: a 32-way bit-partitioned trie with a tail, like Clojure's
+# vectors
+# - `v[i]` walks one node per 5 bits of `i`, at most 4 levels for 1M items
+# - the last (up to) 32 items live in a separate `tail` list, so `append`
+#   usually copies just that
+# - `v.set(i, x)`, `v.append(x)`, `v.extend(xs)` return new vectors;
+#   `PVector(list)` builds bottom-up in O(n); `list(v)` converts back;
+#   `==` compares items, as for tuples
+
+# nodes are plain lists for speed; nothing mutates a node once it's
+# reachable from a published map or vector
+
+import collections.abc
+
+_NODE = object()
+_MISSING = object()
+_HASH_MASK = (1 << 64) - 1
+_MAX_SHIFT = 60  # 13 levels x 5 bits covers a 64-bit hash
+
+
+class _Bitmap:
+    __slots__ = ("bitmap", "items")
+
+    def __init__(self, bitmap, items):
+        self.bitmap = bitmap
+        self.items = items
+
+
+class _Collision:
+    __slots__ = ("hash", "items")
+
+    def __init__(self, hash, items):
+        self.hash = hash
+        self.items = items
+
+
+_EMPTY = _Bitmap(0, [])
+
+
+def _hash(key):
+    return hash(key) & _HASH_MASK
+
+
+def _lookup(node, h, key, default):
+    shift = 0
+    while True:
+        if node.__class__ is _Collision:
+            items = node.items
+            for i in range(0, len(items), 2):
+                if items[i] == key:
+                    return items[i + 1]
+            return default
+        bit = 1 << ((h >> shift) & 31)
+        bitmap = node.bitmap
+        if not bitmap & bit:
+            return default
+        i = 2 * (bitmap & (bit - 1)).bit_count()
+        k = node.items[i]
+        if k is _NODE:
+            node = node.items[i + 1]
+            shift += 5
+            continue
+        if k is key or k == key:
+            return node.items[i + 1]
+        return default
+
+
+def _merge(shift, h1, k1, v1, h2, k2, v2):
+    # a node holding two keys that shared a slot one level up
+    if shift > _MAX_SHIFT:
+        return _Collision(h1, [k1, v1, k2, v2])
+    b1 = (h1 >> shift) & 31
+    b2 = (h2 >> shift) & 31
+    if b1 == b2:
+        return _Bitmap(1 << b1, [_NODE, _merge(shift + 5, h1, k1, v1,
+                                               h2, k2, v2)])
+    items = [k1, v1, k2, v2] if b1 < b2 else [k2, v2, k1, v1]
+    return _Bitmap((1 << b1) | (1 << b2), items)
+
+
+def _assoc(node, shift, h, key, value, mutate=False):
+    # returns (node, added); `node` is the same object when nothing changed
+    if node.__class__ is _Collision:
+        items = node.items
+        for i in range(0, len(items), 2):
+            if items[i] == key:
+                if items[i + 1] is value:
+                    return node, False
+                items = items if mutate else items[:]
+                items[i + 1] = value
+                return _Collision(node.hash, items), False
+        return _Collision(node.hash, items + [key, value]), True
+
+    bit = 1 << ((h >> shift) & 31)
+    i = 2 * (node.bitmap & (bit - 1)).bit_count()
+    items = node.items
+    if not node.bitmap & bit:
+        if mutate:
+            items[i:i] = [key, value]
+            node.bitmap |= bit
+            return node, True
+        return _Bitmap(node.bitmap | bit,
+                       items[:i] + [key, value] + items[i:]), True
+
+    k = items[i]
+    if k is _NODE:
+        child = items[i + 1]
+        new, added = _assoc(child, shift + 5, h, key, value, mutate)
+        if new is child:
+            return node, added
+        new_value = new
+    elif k is key or k == key:
+        if items[i + 1] is value:
+            return node, False
+        new, added, new_value = None, False, value
+    else:
+        new_value = _merge(shift + 5, _hash(k), k, items[i + 1],
+                           h, key, value)
+        added = True
+        k = _NODE
+    if mutate:
+        items[i] = k
+        items[i + 1] = new_value
+        return node, added
+    items = items[:]
+    items[i] = k
+    items[i + 1] = new_value
+    return _Bitmap(node.bitmap, items), added
+
+
+def _dissoc(node, shift, h, key):
+    # returns the new node, `None` if it became empty, or `node` itself
+    # when `key` wasn't there
+    if node.__class__ is _Collision:
+        items = node.items
+        for i in range(0, len(items), 2):
+            if items[i] == key:
+                rest = items[:i] + items[i + 2:]
+                if len(rest) == 2:
+                    # one key left: a plain node, which the caller inlines
+                    return _Bitmap(1 << ((node.hash >> shift) & 31), rest)
+                return _Collision(node.hash, rest)
+        return node
+
+    bit = 1 << ((h >> shift) & 31)
+    if not node.bitmap & bit:
+        return node
+    i = 2 * (node.bitmap & (bit - 1)).bit_count()
+    items = node.items
+    k = items[i]
+    if k is _NODE:
+        child = items[i + 1]
+        new = _dissoc(child, shift + 5, h, key)
+        if new is child:
+            return node
+        if new is not None:
+            if new.__class__ is _Bitmap and len(new.items) == 2 and \
+                    new.items[0] is not _NODE:
+                # a sub-node down to one key: keep it inline here instead
+                items = items[:]
+                items[i:i + 2] = new.items
+            else:
+                items = items[:]
+                items[i + 1] = new
+            return _Bitmap(node.bitmap, items)
+    elif not (k is key or k == key):
+        return node
+    if node.bitmap == bit:
+        return None
+    return _Bitmap(node.bitmap ^ bit, items[:i] + items[i + 2:])
+
+
+def _walk(node):
+    # yields keys and values alternately, in trie order
+    items = node.items
+    for i in range(0, len(items), 2):
+        if items[i] is _NODE:
+            yield from _walk(items[i + 1])
+        else:
+            yield items[i]
+            yield items[i + 1]
+
+
+class PMap(collections.abc.Mapping):
+    __slots__ = ("_root", "_len")
+
+    def __init__(self, mapping=()):
+        root = _Bitmap(0, [])
+        count = 0
+        pairs = mapping.items() if hasattr(mapping, "items") else mapping
+        for key, value in pairs:
+            root, added = _assoc(root, 0, _hash(key), key, value,
+                                 mutate=True)
+            count += added
+        self._root = root
+        self._len = count
+
+    @classmethod
+    def _make(cls, root, count):
+        m = object.__new__(cls)
+        m._root = root
+        m._len = count
+        return m
+
+    def __getitem__(self, key):
+        value = _lookup(self._root, _hash(key), key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        return _lookup(self._root, _hash(key), key, default)
+
+    def __contains__(self, key):
+        return _lookup(self._root, _hash(key), key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        walk = _walk(self._root)
+        for key in walk:
+            next(walk)
+            yield key
+
+    def _items(self):
+        # (key, value) pairs in one walk, without a lookup per key as the
+        # `ItemsView` from `Mapping.items()` does
+        walk = _walk(self._root)
+        return zip(walk, walk)
+
+    def todict(self):
+        return dict(self._items())
+
+    def set(self, key, value):
+        root, added = _assoc(self._root, 0, _hash(key), key, value)
+        if root is self._root:
+            return self
+        return PMap._make(root, self._len + added)
+
+    def delete(self, key):
+        root = _dissoc(self._root, 0, _hash(key), key)
+        if root is self._root:
+            raise KeyError(key)
+        return PMap._make(_EMPTY if root is None else root, self._len - 1)
+
+    def update(self, mapping):
+        m = self
+        pairs = mapping.items() if hasattr(mapping, "items") else mapping
+        for key, value in pairs:
+            m = m.set(key, value)
+        return m
+
+    def __repr__(self):
+        return "PMap({!r})".format(self.todict())
+
+
+class PVector(collections.abc.Sequence):
+    __slots__ = ("_len", "_shift", "_root", "_tail")
+
+    def __init__(self, iterable=()):
+        items = list(iterable)
+        tail_len = len(items) % 32 or min(32, len(items))
+        split = len(items) - tail_len
+        # leaves, then one level of parents at a time until one node is left
+        level = [items[i:i + 32] for i in range(0, split, 32)]
+        shift = 5
+        while len(level) > 32:
+            level = [level[i:i + 32] for i in range(0, len(level), 32)]
+            shift += 5
+        self._len = len(items)
+        self._shift = shift
+        self._root = level
+        self._tail = items[split:]
+
+    @classmethod
+    def _make(cls, count, shift, root, tail):
+        v = object.__new__(cls)
+        v._len = count
+        v._shift = shift
+        v._root = root
+        v._tail = tail
+        return v
+
+    def __len__(self):
+        return self._len
+
+    def _tail_offset(self):
+        return self._len - len(self._tail)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return PVector(self[j] for j in range(*i.indices(self._len)))
+        if i < 0:
+            i += self._len
+        if not 0 <= i < self._len:
+            raise IndexError("PVector index out of range")
+        offset = self._len - len(self._tail)
+        if i >= offset:
+            return self._tail[i - offset]
+        node = self._root
+        for level in range(self._shift, 0, -5):
+            node = node[(i >> level) & 31]
+        return node[i & 31]
+
+    def __iter__(self):
+        yield from _leaves(self._root, self._shift)
+        yield from self._tail
+
+    def tolist(self):
+        return list(self)
+
+    # equal to other PVectors with equal items, like tuples are to tuples;
+    # immutable, so hashable
+
+    def __eq__(self, other):
+        if not isinstance(other, PVector):
+            return NotImplemented
+        return self is other or (self._len == other._len and
+                                 self.tolist() == other.tolist())
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def set(self, i, value):
+        if i < 0:
+            i += self._len
+        if not 0 <= i < self._len:
+            raise IndexError("PVector index out of range")
+        offset = self._tail_offset()
+        if i >= offset:
+            tail = self._tail[:]
+            tail[i - offset] = value
+            return PVector._make(self._len, self._shift, self._root, tail)
+        return PVector._make(self._len, self._shift,
+                             _set(self._root, self._shift, i, value),
+                             self._tail)
+
+    def append(self, value):
+        if len(self._tail) < 32:
+            return PVector._make(self._len + 1, self._shift, self._root,
+                                 self._tail + [value])
+        # the tail is full: it becomes a leaf in the trie
+        root, shift = self._root, self._shift
+        if (self._len >> 5) > (1 << shift):
+            root = [root, _path(shift, self._tail)]
+            shift += 5
+        else:
+            root = _push(root, shift, self._len - 1, self._tail)
+        return PVector._make(self._len + 1, shift, root, [value])
+
+    def extend(self, iterable):
+        v = self
+        for value in iterable:
+            v = v.append(value)
+        return v
+
+    def __repr__(self):
+        return "PVector({!r})".format(self.tolist())
+
+
+def _leaves(node, shift):
+    if shift == 5:
+        for leaf in node:
+            yield from leaf
+    else:
+        for child in node:
+            yield from _leaves(child, shift - 5)
+
+
+def _set(node, shift, i, value):
+    node = node[:]
+    if shift == 0:
+        node[i & 31] = value
+    else:
+        j = (i >> shift) & 31
+        node[j] = _set(node[j], shift - 5, i, value)
+    return node
+
+
+def _path(shift, leaf):
+    # a chain of single-child nodes down to `leaf`
+    node = leaf
+    for _ in range(shift, 0, -5):
+        node = [node]
+    return node
+
+
+def _push(node, shift, last, leaf):
+    # `last` is the index of the last item in `leaf`
+    node = node[:]
+    j = (last >> shift) & 31
+    if shift == 5:
+        node.append(leaf)
+    elif j < len(node):
+        node[j] = _push(node[j], shift - 5, last, leaf)
+    else:
+        node.append(_path(shift - 5, leaf))
+    return node
+
+
+def main():
+    import copy
+    import random
+    import timeit
+
+    config = PMap({"db": "postgres", "pool": 8, "debug": False})
+    request_config = config.set("debug", True)
+    print(config["debug"], request_config["debug"], len(request_config))
+    print(dict(request_config.delete("pool")) ==
+          {"db": "postgres", "debug": True})
+    # >>> False True 3
+    # >>> True
+
+    v = PVector(range(5))
+    v2 = v.set(0, "a").append(5)
+    print(list(v), list(v2))
+    # >>> [0, 1, 2, 3, 4] ['a', 1, 2, 3, 4, 5]
+
+    # consistency against dict / list
+    rnd = random.Random(44)
+    d, m = {}, PMap()
+    for _ in range(20000):
+        k = rnd.randrange(5000)
+        if rnd.random() < 0.3 and k in d:
+            del d[k]
+            m = m.delete(k)
+        else:
+            d[k] = rnd.random()
+            m = m.set(k, d[k])
+    assert dict(m.items()) == d and len(m) == len(d) == len(m.items())
+    assert m.todict() == d and m == d and set(m.values()) == set(d.values())
+    big = list(range(40000))
+    pv = PVector(range(100)).extend(range(100, 40000))
+    assert list(pv) == big == list(PVector(big)) and pv == PVector(big)
+    assert pv != pv.set(5, -1) and hash(pv) == hash(PVector(big))
+    assert all(pv[i] == i for i in range(0, 40000, 7))
+
+    n = 1000000
+    data = {i: i for i in range(n)}
+    items = list(range(n))
+    keys = [rnd.randrange(n) for _ in range(1000)]
+
+    pm = PMap(data)
+    vec = PVector(items)
+    print("1M entries, seconds per operation")
+    rows = (
+        ("PMap(dict)", lambda: PMap(data), 1),
+        ("pmap.todict()", lambda: pm.todict(), 1),
+        ("dict.copy() + set", lambda: data.copy().__setitem__(5, 0), 10),
+        ("deepcopy + set",
+         lambda: copy.deepcopy(data).__setitem__(5, 0), 1),
+        ("PMap.set", lambda: [pm.set(k, 0) for k in keys], 1000),
+        ("PMap[k]", lambda: [pm[k] for k in keys], 1000),
+        ("dict[k]", lambda: [data[k] for k in keys], 1000),
+        ("PVector(list)", lambda: PVector(items), 1),
+        ("list.copy() + set", lambda: items[:].__setitem__(5, 0), 10),
+        ("PVector.set", lambda: [vec.set(k, 0) for k in keys], 1000),
+        ("PVector.append", lambda: [vec.append(k) for k in keys], 1000),
+        ("PVector[i]", lambda: [vec[k] for k in keys], 1000),
+    )
+    # (per_call: operations per timed statement)
+    for label, stmt, per_call in rows:
+        t = min(timeit.repeat(stmt, number=1, repeat=3)) / per_call
+        print("{:<20} {:>12.2e}".format(label, t))
+    # >>> 1M entries, seconds per operation
+    # >>> PMap(dict)               1.52e+00
+    # >>> pmap.todict()            5.20e-01
+    # >>> dict.copy() + set        3.25e-03
+    # >>> deepcopy + set           4.98e-01
+    # >>> PMap.set                 8.20e-06
+    # >>> PMap[k]                  2.01e-06
+    # >>> dict[k]                  9.14e-08
+    # >>> PVector(list)            1.56e-02
+    # >>> list.copy() + set        4.23e-04
+    # >>> PVector.set              2.67e-06
+    # >>> PVector.append           1.02e-06
+    # >>> PVector[i]               4.52e-07
+
+    # a new version costs ~8us instead of a 3ms `dict.copy()` (or 0.5s of
+    # deepcopy); the price is reads ~20x slower than a dict (pure Python
+    # trie walk) and a slow one-off conversion from a big dict, so build
+    # the PMap once and keep passing versions around
+
+
+if __name__ == '__main__':
+    main()
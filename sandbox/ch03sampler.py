@@ -0,0 +1,220 @@
+# # Background Sampling Profiler
+
+# chapter03's traceback example walks `tb_next` / `tb_frame` to print
+# `top` -> `middle` -> `bottom`; every frame also links to its caller
+# through `f_back`, and `sys._current_frames()` hands out the current frame
+# of every thread, so a profiler can read all stacks from the outside
+# without tracing a single call
+
+# `Sampler` is a statistical (wall-clock) profiler
+# - `start()` runs a daemon thread that wakes every `interval` seconds
+#   (default 0.01, i.e. 100 Hz), grabs `sys._current_frames()`, walks each
+#   thread's `f_back` chain and counts the stack it found; `stop()` ends
+#   it, `with Sampler():` does both
+# - a sample only collects code objects into a tuple and bumps a `Counter`;
+#   names are formatted once per distinct stack, when reporting; the
+#   program itself runs untraced, so the cost is the GIL time of the
+#   walks: well under 1% at 100 Hz
+# - the sampler's own thread is skipped; other idle threads show up with
+#   the stack they're waiting in (it's wall-clock time, not CPU time)
+# - `collapsed()` returns the counts in Brendan Gregg's collapsed-stack
+#   format, one `root;caller;...;leaf count` line per stack, ready for
+#   `flamegraph.pl` or speedscope; `dump(path)` writes it
+# - `dump_on_signal(path)` installs a handler (SIGUSR1 by default) so a
+#   running process can be asked for a snapshot, `kill -USR1 <pid>`,
+#   without stopping the sampler
+# - `by_thread=True` puts the thread name at the root of every stack
+
+import collections
+import os
+import signal
+import sys
+import threading
+import time
+
+
+def _label(code):
+    name = getattr(code, "co_qualname", code.co_name)  # 3.11+
+    return "{}:{}".format(os.path.basename(code.co_filename),
+                          name).replace(";", ",")
+
+
+class Sampler:
+    def __init__(self, interval=0.01, by_thread=False):
+        self.interval = interval
+        self.by_thread = by_thread
+        self.counts = collections.Counter()
+        self.samples = 0
+        self.elapsed = 0.0  # seconds spent sampling, not between samples
+        # reentrant: the `dump_on_signal` handler can interrupt the main
+        # thread while it's inside `collapsed()` or `clear()`
+        self._lock = threading.RLock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            raise RuntimeError("sampler already running")
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="Sampler")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _run(self):
+        me = threading.get_ident()
+        names = {}
+        deadline = time.monotonic()
+        while True:
+            # fixed schedule: a slow sample doesn't shift the later ones
+            deadline += self.interval
+            delay = deadline - time.monotonic()
+            if delay < 0:
+                deadline -= delay  # fell behind; don't burst to catch up
+                delay = 0
+            if self._stopping.wait(delay):
+                return
+            start = time.perf_counter()
+            if self.by_thread:
+                names = {t.ident: t.name for t in threading.enumerate()}
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                if self.by_thread:
+                    stack.append(names.get(ident, str(ident)))
+                stacks.append(tuple(stack))
+            with self._lock:
+                self.counts.update(stacks)
+                self.samples += 1
+                self.elapsed += time.perf_counter() - start
+
+    def collapsed(self):
+        # "root;...;leaf count" lines, most frequent first
+        with self._lock:
+            counts = self.counts.copy()
+        merged = collections.Counter()
+        for stack, count in counts.items():
+            # stacks are stored leaf first, with the thread name (a str)
+            # at the end if any
+            labels = [frame if isinstance(frame, str) else _label(frame)
+                      for frame in reversed(stack)]
+            merged[";".join(labels)] += count
+        return "".join("{} {}\n".format(stack, count)
+                       for stack, count in merged.most_common())
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            f.write(self.collapsed())
+
+    def dump_on_signal(self, path, signum=getattr(signal, "SIGUSR1", None)):
+        # the handler runs in the main thread between bytecodes; only
+        # callable from the main thread, like `signal.signal`
+        if signum is None:
+            raise ValueError("no SIGUSR1 on this platform; pass signum")
+
+        def handler(signum, frame):
+            self.dump(path)
+
+        return signal.signal(signum, handler)
+
+    def clear(self):
+        with self._lock:
+            self.counts.clear()
+            self.samples = 0
+            self.elapsed = 0.0
+
+
+# ## Example
+
+
+def bottom(n):
+    return sum(i * i for i in range(n))
+
+
+def middle(n):
+    return bottom(n) + bottom(n // 2)
+
+
+def top(n):
+    return middle(n) + sum(range(n))
+
+
+def workload():
+    total = 0
+    for _ in range(40):
+        total += top(200000)
+    return total
+
+
+def main():
+    import tempfile
+    import timeit
+
+    with Sampler() as sampler:
+        workload()
+    lines = sampler.collapsed().splitlines()
+    for line in lines[:4]:
+        # drop the caller frames above `workload`, and the file names
+        line = line[line.index("ch03sampler.py:workload"):]
+        print(line.replace("ch03sampler.py:", ""))
+    # >>> workload;top;middle;bottom;bottom.<locals>.<genexpr> 75
+    # >>> workload;top 6
+
+    # the signal-triggered dump, with the sampler still running
+    path = os.path.join(tempfile.mkdtemp(), "stacks.txt")
+    sampler = Sampler(by_thread=True)
+    sampler.dump_on_signal(path)
+    with sampler:
+        top(2000000)
+        os.kill(os.getpid(), signal.SIGUSR1)
+        top(1000)
+    with open(path) as f:
+        print(f.readline().split(";")[0], "...")
+    # >>> MainThread ...
+
+    # overhead: the same workload with and without sampling at 100 Hz, in
+    # alternating rounds so drift in machine speed hits both alike; a few
+    # idle threads give the sampler more stacks to walk
+    idle = threading.Event()
+    for _ in range(4):
+        threading.Thread(target=idle.wait, daemon=True).start()
+    plain, sampled = [], []
+    profile = Sampler(interval=0.01)
+    for _ in range(7):
+        plain.append(timeit.timeit(workload, number=1))
+        with profile:
+            sampled.append(timeit.timeit(workload, number=1))
+    idle.set()
+    plain_time, sampled_time = min(plain), min(sampled)
+    print("without: {:.3f}s  with: {:.3f}s  overhead: {:+.2%}".format(
+        plain_time, sampled_time, sampled_time / plain_time - 1))
+    print("{} samples, {:.1f}us of walking per sample".format(
+        profile.samples, 1e6 * profile.elapsed / profile.samples))
+    # >>> without: 0.791s  with: 0.787s  overhead: -0.54%
+    # >>> 626 samples, 46.2us of walking per sample
+
+    # 46us of GIL time every 10ms is ~0.5%, below the run-to-run noise;
+    # the cost grows with the number of threads and their stack depth, so
+    # check `elapsed / samples` against `interval` in the real process
+
+
+if __name__ == '__main__':
+    main()
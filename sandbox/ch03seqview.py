@@ -0,0 +1,196 @@
+# # Zero-Copy Slice Views
+
+# chapter03's `MyCollection.__getitem__` hands slices to the underlying
+# sequence, so `c[:4]` copies; a chain like `data[a:b][1:-1][::2]` copies at
+# every step, and each copy of a list is a pointer per item plus an
+# incref each
+
+# `SeqView(base)` is a read-only window over any sequence that never copies
+# - it records which indices of `base` it covers as a `range`, i.e.
+#   (start, stop, step); slicing a view slices that range, and `range`
+#   already composes slices arithmetically (in C, with the same clipping
+#   and negative-index rules as `list`), so `view[a:b][::2]` is O(1)
+# - `view[i]`, `len`, iteration, `reversed`, `in`, `index` and `count`
+#   read straight from `base`; iteration is `map(base.__getitem__, range)`,
+#   no bytecode per item
+# - `materialize()` makes the one copy, as `base`'s own type when `base`
+#   supports slicing (`list`, `str`, `bytes`, `array`, ...), a `list`
+#   otherwise
+# - like a `memoryview`, a view assumes `base` doesn't shrink under it;
+#   in-place updates to `base` show through
+
+import collections.abc
+import operator
+
+
+class SeqView(collections.abc.Sequence):
+    __slots__ = ("base", "_indices")
+
+    def __init__(self, base, start=None, stop=None, step=None):
+        if isinstance(base, SeqView):
+            base, indices = base.base, base._indices
+        else:
+            indices = range(len(base))
+        self.base = base
+        self._indices = indices[start:stop:step]
+
+    @classmethod
+    def _from_range(cls, base, indices):
+        view = cls.__new__(cls)
+        view.base = base
+        view._indices = indices
+        return view
+
+    @property
+    def start(self):
+        return self._indices.start
+
+    @property
+    def stop(self):
+        return self._indices.stop
+
+    @property
+    def step(self):
+        return self._indices.step
+
+    def __len__(self):
+        return len(self._indices)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return SeqView._from_range(self.base, self._indices[index])
+        return self.base[self._indices[index]]
+
+    def __iter__(self):
+        return map(self.base.__getitem__, self._indices)
+
+    def __reversed__(self):
+        return map(self.base.__getitem__, reversed(self._indices))
+
+    def __contains__(self, value):
+        return value in iter(self)
+
+    def count(self, value):
+        return operator.countOf(iter(self), value)
+
+    def index(self, value, start=0, stop=None):
+        # `operator.indexOf` raises ValueError for a missing value too
+        i = operator.indexOf(iter(self[start:stop]), value)
+        return range(len(self))[start:stop][i]
+
+    def materialize(self):
+        r = self._indices
+        try:
+            if not r:
+                # an empty range's bounds can be anything, even negative
+                return self.base[0:0]
+            # a non-empty range starts at a valid index, and a negative stop
+            # only shows up with a negative step, where it means "past index
+            # 0", i.e. an open-ended slice
+            return self.base[r.start:None if r.stop < 0 else r.stop:r.step]
+        except TypeError:
+            return list(self)
+
+    def __repr__(self):
+        return "SeqView({!r}, {}, {}, {})".format(
+            self.base if len(self.base) <= 10 else type(self.base),
+            self.start, self.stop, self.step)
+
+
+# ## Example
+
+
+class MyCollection:
+    # chapter03's wrapper, with slices returning views instead of copies
+    def __init__(self, values):
+        self.values = values
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return SeqView(self.values)[key]
+        return self.values.__getitem__(key)
+
+    def __contains__(self, key):
+        return self.values.__contains__(key)
+
+
+def main():
+    import timeit
+
+    c = MyCollection("ABCDEF")
+    print(c[:4], c[:4][::-1].materialize(), c[1:][::2].index("D"))
+    print(list(SeqView(range(10))[2:][::-3][1:]))
+    # >>> SeqView('ABCDEF', 0, 4, 1) DCBA 1
+    # >>> [6, 3]
+
+    # consistency against list slicing
+    base = list(range(23))
+    slices = [slice(a, b, c) for a in (None, 0, 3, -4, 30)
+              for b in (None, -1, 5, 17, 40) for c in (None, 1, 2, -1, -3)]
+    for first in slices:
+        for second in slices[::7]:
+            expected = base[first][second]
+            view = SeqView(base)[first][second]
+            assert list(view) == expected == view.materialize()
+            assert list(reversed(view)) == expected[::-1]
+            for x in expected[1:4]:
+                assert view.index(x) == expected.index(x)
+                if x != expected[-1]:
+                    assert view.index(x, 1, -1) == expected.index(x, 1, -1)
+    assert SeqView(base)[::2].count(4) == 1 and 5 not in SeqView(base)[::2]
+
+    n = 10000000
+    data = list(range(n))
+    window = 100000
+    starts = range(0, n - window, window // 2)
+
+    def with_lists():
+        total = 0
+        for a in starts:
+            w = data[a:a + window]
+            total += sum(w[10:-10][::2])
+        return total
+
+    def with_views():
+        view = SeqView(data)
+        total = 0
+        for a in starts:
+            w = view[a:a + window]
+            total += sum(w[10:-10][::2])
+        return total
+
+    def lists_only():
+        for a in starts:
+            data[a:a + window][10:-10][::2]
+
+    def views_only():
+        view = SeqView(data)
+        for a in starts:
+            view[a:a + window][10:-10][::2]
+
+    assert with_lists() == with_views()
+    print("{:,} items, {} windows of {:,}; seconds".format(
+        n, len(starts), window))
+    for label, func in (("list slices", lists_only),
+                        ("SeqView slices", views_only),
+                        ("list slices + sum", with_lists),
+                        ("SeqView slices + sum", with_views)):
+        t = min(timeit.repeat(func, number=1, repeat=3))
+        print("{:<22} {:>8.4f}".format(label, t))
+    # >>> 10,000,000 items, 198 windows of 100,000; seconds
+    # >>> list slices              0.2994
+    # >>> SeqView slices           0.0003
+    # >>> list slices + sum        0.2769
+    # >>> SeqView slices + sum     0.3244
+
+    # building the chains drops from ~1.5ms per window to ~1.5us; reading
+    # every item through a view costs about what the copies did (a
+    # `__getitem__` call per item instead of a memcpy), so views pay off
+    # when most of each window is skipped, or just to keep peak memory flat
+
+
+if __name__ == '__main__':
+    main()
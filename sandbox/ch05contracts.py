@@ -0,0 +1,220 @@
+# # Sampled Runtime Contracts
+
+# builds on ch05's `assert` / `if __debug__:` notes
+# - with `-O`, `__debug__` is False, so `contract(...)` and `invariant(...)`
+#   hand back the undecorated function / class: zero per-call cost
+# - without `-O`, each decorated function checks only a sample of its calls:
+#   - `first=N`: check the first N calls, then stop checking
+#   - `rate=r`: check roughly a fraction `r` of calls (every `1/r`-th call)
+#   - both given: check the first N, then sample at `rate`
+# - violations are counted per function in `VIOLATIONS` (see `violations()`)
+#   and raise `ContractViolation` unless `raise_on_violation=False`
+
+# conditions are plain callables:
+# - `pre(*args, **kwargs)` -> truthy if the call may proceed
+# - `post(result, *args, **kwargs)` -> truthy if the result is acceptable
+# - `invariant(self)` -> truthy if the instance is consistent
+
+import collections
+import functools
+
+DEFAULT_RATE = 1.0
+DEFAULT_FIRST = None
+
+# "module.qualname" -> counts, e.g. {"pre": 1, "post": 0, "invariant": 0}
+VIOLATIONS = collections.defaultdict(collections.Counter)
+# "module.qualname" -> number of calls that were actually checked
+CHECKED = collections.Counter()
+
+
+class ContractViolation(AssertionError):
+    pass
+
+
+def violations():
+    return {name: dict(counts) for name, counts in VIOLATIONS.items()}
+
+
+def reset():
+    VIOLATIONS.clear()
+    CHECKED.clear()
+
+
+def _sampling(rate, first):
+    # -> (first, every): check calls 1..first, then every `every`-th call
+    if rate is None:
+        rate = DEFAULT_RATE if first is None else 0.0
+    if not 0 <= rate <= 1:
+        raise ValueError("rate must be between 0 and 1, not {!r}".format(
+            rate))
+    every = int(round(1 / rate)) if rate > 0 else 0
+    return (first or 0), every
+
+
+def _violated(name, kind, message, raise_on_violation):
+    VIOLATIONS[name][kind] += 1
+    if raise_on_violation:
+        raise ContractViolation("{} {} failed: {}".format(name, kind, message))
+
+
+def contract(pre=None, post=None, rate=None, first=DEFAULT_FIRST,
+             raise_on_violation=True):
+    check_first, every = _sampling(rate, first)  # validates `rate` early
+
+    def decorate(func):
+        if not __debug__:
+            return func
+
+        name = "{}.{}".format(func.__module__, func.__qualname__)
+        pre_conds = _as_tuple(pre)
+        post_conds = _as_tuple(post)
+        calls = 0
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # the unchecked path is kept as short as possible
+            nonlocal calls
+            calls += 1
+            if calls > check_first and (not every or calls % every):
+                return func(*args, **kwargs)
+
+            CHECKED[name] += 1
+            for cond in pre_conds:
+                if not cond(*args, **kwargs):
+                    _violated(name, "pre", _describe(cond),
+                              raise_on_violation)
+
+            result = func(*args, **kwargs)
+
+            for cond in post_conds:
+                if not cond(result, *args, **kwargs):
+                    _violated(name, "post", _describe(cond),
+                              raise_on_violation)
+            return result
+
+        wrapper.__contract_name__ = name
+        return wrapper
+
+    return decorate
+
+
+def invariant(check, rate=None, first=DEFAULT_FIRST,
+              raise_on_violation=True):
+    # class decorator: re-checks `check(self)` after public methods
+    # (and `__init__`) on the sampled calls
+    _sampling(rate, first)  # validates `rate` early
+
+    def decorate(cls):
+        if not __debug__:
+            return cls
+
+        for attr, value in list(vars(cls).items()):
+            # staticmethod / classmethod objects are callable on 3.10+, but
+            # have no instance to check
+            if not callable(value) or isinstance(
+                    value, (type, staticmethod, classmethod)):
+                continue
+            if attr.startswith("_") and attr != "__init__":
+                continue
+            setattr(cls, attr, _check_after(value, check, rate, first,
+                                            raise_on_violation))
+        return cls
+
+    return decorate
+
+
+def _check_after(method, check, rate, first, raise_on_violation):
+    name = "{}.{}".format(method.__module__, method.__qualname__)
+    check_first, every = _sampling(rate, first)
+    calls = 0
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        nonlocal calls
+        result = method(self, *args, **kwargs)
+        calls += 1
+        if calls <= check_first or (every and not calls % every):
+            CHECKED[name] += 1
+            if not check(self):
+                _violated(name, "invariant", _describe(check),
+                          raise_on_violation)
+        return result
+
+    return wrapper
+
+
+def _as_tuple(conds):
+    if conds is None:
+        return ()
+    if callable(conds):
+        return (conds,)
+    return tuple(conds)
+
+
+def _describe(cond):
+    return getattr(cond, "__name__", repr(cond))
+
+
+# ## Example
+
+
+@contract(pre=lambda xs: len(xs) > 0,
+          post=lambda r, xs: min(xs) <= r <= max(xs),
+          first=3, rate=0.01)
+def mean(xs):
+    return sum(xs) / len(xs)
+
+
+@invariant(lambda acct: acct.balance >= 0, rate=0.5,
+           raise_on_violation=False)
+class Account:
+    def __init__(self, balance):
+        self.balance = balance
+
+    def withdraw(self, amount):
+        self.balance -= amount
+
+
+def main():
+    import timeit
+
+    mean([1, 2, 3])
+    if __debug__:
+        try:
+            mean([])
+        except ContractViolation as e:
+            print(e)
+    # >>> __main__.mean pre failed: <lambda>
+
+    # ten withdrawals overdraw the account; every other call is checked,
+    # and the violations are counted rather than raised
+    acct = Account(50)
+    for _ in range(15):
+        acct.withdraw(10)
+    print(violations())
+    # >>> {'__main__.mean': {'pre': 1},
+    # >>>  '__main__.Account.withdraw': {'invariant': 5}}
+
+    # cost of checking: the same function undecorated, sampled (first 3,
+    # then 1%) and checked on every call
+    def plain(xs):
+        return sum(xs) / len(xs)
+
+    every = contract(pre=lambda xs: len(xs) > 0,
+                     post=lambda r, xs: min(xs) <= r <= max(xs))(plain)
+    data = list(range(100))
+    n = 100000
+    for label, fx in (("plain", plain), ("sampled", mean),
+                      ("every call", every)):
+        print("{:<10} {:.3f}s".format(
+            label, timeit.timeit(lambda: fx(data), number=n)))
+    # >>> plain      0.099s
+    # >>> sampled    0.149s
+    # >>> every call 0.746s
+
+    # under `python -O`, `mean` *is* the undecorated function, and both
+    # decorated rows match "plain"
+
+
+if __name__ == '__main__':
+    main()
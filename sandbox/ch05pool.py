@@ -0,0 +1,334 @@
+# # Pooled Resources via the Context Management Protocol
+
+# builds on `Foo` (ch05) and `MyContextMgr` (ch03): instead of just printing
+# in `__enter__` / `__exit__`, the context manager checks an expensive handle
+# out of a pool and hands it back when the `with` block finishes
+
+# - `with pool.acquire() as r:` -> `r` is a live handle
+# - the handle goes back to the pool even if the block raises
+#   (`__exit__` always runs)
+# - `max_size` caps how many handles can exist at once
+# - handles idle longer than `idle_timeout` are closed and evicted
+# - `check` (optional) is run on checkout; unhealthy handles are closed and
+#   replaced
+# - `pool.discard(r)` closes a broken handle and frees its slot; inside
+#   `with pool.acquire() as r:` the block's exit then skips returning it
+# - `put` and `discard` only take handles the pool handed out and hasn't
+#   had back yet; anything else is a `ValueError`
+# - `acquire(block=False)` fails fast; `acquire(timeout=...)` waits at most
+#   that long; both raise `PoolExhausted`
+# - `stats()` reports wait time and saturation counters
+
+import collections
+import threading
+import time
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class _Checkout:
+    def __init__(self, pool, block, timeout):
+        self.pool = pool
+        self.block = block
+        self.timeout = timeout
+        self.resource = None
+        self.discarded = False
+
+    def __enter__(self):
+        self.resource = self.pool.get(self.block, self.timeout)
+        self.discarded = False
+        with self.pool._cond:
+            self.pool._checkouts[id(self.resource)] = self
+        return self.resource
+
+    def __exit__(self, type, value, tb):
+        resource, self.resource = self.resource, None
+        with self.pool._cond:
+            self.pool._checkouts.pop(id(resource), None)
+        # `pool.discard(r)` inside the block already freed the slot
+        if not self.discarded:
+            self.pool.put(resource)
+        # returning False lets the exception (if any) propagate
+        return False
+
+
+class Pool:
+    def __init__(self, create, close=None, check=None, max_size=8,
+                 idle_timeout=None, clock=time.monotonic):
+        self.create = create
+        self.close = close
+        self.check = check
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+
+        # idle handles, most recently returned on the right: (resource, since)
+        self._idle = collections.deque()
+        self._size = 0
+        # id(resource) -> resource, for every handle out through `get()`
+        self._out = {}
+        # id(resource) -> _Checkout, for handles out through `acquire()`
+        self._checkouts = {}
+        self._cond = threading.Condition(threading.Lock())
+
+        self.created = 0
+        self.closed = 0
+        self.evicted = 0
+        self.failed_checks = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.saturated = 0
+        self.timeouts = 0
+
+    def acquire(self, block=True, timeout=None):
+        return _Checkout(self, block, timeout)
+
+    def get(self, block=True, timeout=None):
+        start = self.clock()
+        waited = False
+
+        with self._cond:
+            while True:
+                self._evict_idle()
+
+                if self._idle:
+                    resource, _ = self._idle.pop()
+                    self._out[id(resource)] = resource
+                    break
+
+                if self._size < self.max_size:
+                    # reserve a slot; the handle is created outside the lock
+                    self._size += 1
+                    resource = None
+                    break
+
+                if not waited:
+                    self.saturated += 1
+
+                if not block:
+                    self.timeouts += 1
+                    raise PoolExhausted("pool exhausted (max_size={})"
+                                        .format(self.max_size))
+
+                remaining = None
+                if timeout is not None:
+                    remaining = timeout - (self.clock() - start)
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolExhausted(
+                            "timed out after {}s waiting for a resource"
+                            .format(timeout))
+
+                waited = True
+                self._cond.wait(remaining)
+
+            if waited:
+                self.waits += 1
+                self.wait_time += self.clock() - start
+            self.checkouts += 1
+
+        if resource is None:
+            return self._create()
+
+        if self.check is not None and not self._healthy(resource):
+            with self._cond:
+                del self._out[id(resource)]
+                self.failed_checks += 1
+                self.closed += 1
+            self._close(resource)
+            return self._create()
+
+        return resource
+
+    def _release(self, resource):
+        # called with the lock held
+        if self._out.pop(id(resource), None) is not resource:
+            raise ValueError("resource not checked out from this pool")
+
+    def put(self, resource):
+        with self._cond:
+            self._release(resource)
+            self._idle.append((resource, self.clock()))
+            self._cond.notify()
+
+    def discard(self, resource):
+        # for handles the caller knows are broken; frees the slot, and keeps
+        # the enclosing `with pool.acquire()` from putting the handle back
+        with self._cond:
+            self._release(resource)
+            checkout = self._checkouts.pop(id(resource), None)
+            if checkout is not None:
+                checkout.discarded = True
+            self._size -= 1
+            self.closed += 1
+            self._cond.notify()
+        self._close(resource)
+
+    def evict(self):
+        with self._cond:
+            self._evict_idle()
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, collections.deque()
+            self._size -= len(idle)
+            self.closed += len(idle)
+            self._cond.notify_all()
+        for resource, _ in idle:
+            self._close(resource)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "max_size": self.max_size,
+                "created": self.created,
+                "closed": self.closed,
+                "evicted": self.evicted,
+                "failed_checks": self.failed_checks,
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "wait_time": self.wait_time,
+                "saturated": self.saturated,
+                "timeouts": self.timeouts,
+            }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close_all()
+        return False
+
+    def _create(self):
+        try:
+            resource = self.create()
+        except BaseException:
+            # give the reserved slot back so waiters aren't starved
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self.created += 1
+            self._out[id(resource)] = resource
+        return resource
+
+    def _healthy(self, resource):
+        try:
+            return bool(self.check(resource))
+        except Exception:
+            return False
+
+    def _close(self, resource):
+        # callers count `closed` under the lock
+        if self.close is not None:
+            try:
+                self.close(resource)
+            except Exception:
+                pass
+
+    def _evict_idle(self):
+        # called with the lock held; oldest idle handles sit on the left
+        if self.idle_timeout is None:
+            return
+        cutoff = self.clock() - self.idle_timeout
+        while self._idle and self._idle[0][1] < cutoff:
+            resource, _ = self._idle.popleft()
+            self._size -= 1
+            self.evicted += 1
+            self.closed += 1
+            self._close(resource)
+
+
+class Handle:
+    # stand-in for an expensive file / socket / parser handle
+    opened = 0
+
+    def __init__(self):
+        Handle.opened += 1
+        self.id = Handle.opened
+        self.ok = True
+        time.sleep(0.001)  # pretend opening is costly
+
+    def close(self):
+        self.ok = False
+
+
+def main():
+    import timeit
+
+    pool = Pool(Handle, close=Handle.close, check=lambda h: h.ok,
+                max_size=2, idle_timeout=60)
+
+    with pool.acquire() as h:
+        print("got handle {}".format(h.id))
+    # >>> got handle 1
+
+    # handles are returned even when the block raises
+    try:
+        with pool.acquire() as h:
+            raise ValueError("fubar")
+    except ValueError:
+        pass
+    print("idle after exception: {}".format(pool.stats()["idle"]))
+    # >>> idle after exception: 1
+
+    # unhealthy handles are replaced on checkout
+    with pool.acquire() as h:
+        h.ok = False
+    with pool.acquire() as h:
+        print("replacement handle {}".format(h.id))
+    # >>> replacement handle 2
+
+    # a handle discarded inside the block isn't put back
+    with pool.acquire() as h:
+        pool.discard(h)
+    print("in use after discard: {}".format(pool.stats()["in_use"]))
+    # >>> in use after discard: 0
+
+    # a handle can only be given back once
+    h = pool.get()
+    pool.discard(h)
+    try:
+        pool.discard(h)
+    except ValueError as e:
+        print(e, pool.stats()["size"])
+    # >>> resource not checked out from this pool 0
+
+    # non-blocking acquire when saturated
+    with pool.acquire(), pool.acquire():
+        try:
+            with pool.acquire(block=False):
+                pass
+        except PoolExhausted as e:
+            print(e)
+    # >>> pool exhausted (max_size=2)
+
+    def open_close():
+        h = Handle()
+        h.close()
+
+    def pooled():
+        with pool.acquire() as h:
+            h.id
+
+    n = 200
+    print("open/close per use: {:.6f}s".format(
+        timeit.timeit(open_close, number=n) / n))
+    print("pooled per use:     {:.6f}s".format(
+        timeit.timeit(pooled, number=n) / n))
+    # >>> open/close per use: 0.001079s
+    # >>> pooled per use:     0.000002s
+
+    print(pool.stats())
+    pool.close_all()
+
+
+if __name__ == '__main__':
+    main()
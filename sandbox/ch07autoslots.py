@@ -0,0 +1,325 @@
+# # Inferring `__slots__` for Dict-Backed Classes
+
+# ch07 notes that `__slots__` saves memory and time, but writing them by hand
+# is easy to get wrong, and most model classes (`Foo(bar, baz)`,
+# `OtherDemo`, `SpecialNumber`) never add attributes after `__init__`
+
+# `@autoslots` reads the `self.<name> = ...` assignments in the class's
+# methods (via `ast` on the source; falls back to `STORE_ATTR` in the
+# bytecode when there is no source) and rebuilds the class with those names
+# as `__slots__`
+
+# inheritance:
+# - a slotted class can only have one base with a non-empty slot layout, so
+#   `BasesDemo(DictDemo, OtherDemo)` can't just slot each base separately
+# - instead, every dict-backed base is rebuilt as a copy with
+#   `__slots__ = ()`, and all of their inferred attributes are slotted on
+#   the decorated class itself
+# - the copies are cached, so diamonds share one copy of each base
+# - note: the rebuilt class subclasses those *copies*, so
+#   `isinstance(obj, DictDemo)` is False for the original `DictDemo`
+
+# private names (`self.__value`) are mangled with the name of the class that
+# assigns them, the same way the compiler does it
+
+# `memory_report(before, after, *args)` measures bytes per instance of both
+# versions with `tracemalloc`
+
+import ast
+import dis
+import functools
+import inspect
+import textwrap
+import tracemalloc
+import types
+
+# original base class -> its `__slots__ = ()` copy
+_SHIMS = {}
+
+
+def autoslots(cls=None, weakref=True):
+    # usable as `@autoslots` or `@autoslots(weakref=False)`;
+    # `weakref=True` keeps a `__weakref__` slot so instances can still be
+    # the target of `weakref.ref` (see ch07's `WeakRefExample`)
+    if cls is None:
+        return lambda cls: _rebuild_leaf(cls, weakref)
+    return _rebuild_leaf(cls, weakref)
+
+
+def _rebuild_leaf(cls, weakref):
+    names = []
+    bases = tuple(_shim(b, names) for b in cls.__bases__)
+    _collect(cls, names)
+
+    taken = set()
+    for base in bases:
+        for klass in base.__mro__:
+            taken.update(_own_slots(klass))
+    slots = [n for n in names if n not in taken]
+
+    if weakref and not any(_has_weakref(b) for b in bases):
+        slots.append("__weakref__")
+
+    return _copy_class(cls, bases, tuple(slots))
+
+
+def _shim(base, names):
+    # returns a base that is safe to combine with others in a slotted class,
+    # adding the attributes its instances need to `names`
+    if base is object or not _is_dict_backed(base):
+        return base
+    if base not in _SHIMS:
+        shim_bases = tuple(_shim(b, []) for b in base.__bases__)
+        _SHIMS[base] = _copy_class(base, shim_bases, ())
+    for klass in base.__mro__:
+        if _is_dict_backed(klass) and klass is not object:
+            _collect(klass, names)
+    return _SHIMS[base]
+
+
+def _copy_class(cls, bases, slots):
+    # zero-argument `super()` finds its class through a `__class__` closure
+    # cell; methods using it are copied with a fresh cell for the new class
+    # (the originals keep working for the original class)
+    cell = types.CellType()
+    body = {k: _rebind(v, cls, cell) for k, v in vars(cls).items()
+            if k not in ("__dict__", "__weakref__")}
+    for name in slots:
+        if name in body:
+            raise TypeError(
+                "cannot slot {!r}: it conflicts with class attribute {}.{}"
+                .format(name, cls.__name__, name))
+    body["__slots__"] = slots
+
+    new_cls = type(cls)(cls.__name__, bases, body)
+    new_cls.__qualname__ = cls.__qualname__
+    cell.cell_contents = new_cls
+    return new_cls
+
+
+def _rebind(value, old_cls, cell):
+    if isinstance(value, (staticmethod, classmethod)):
+        return type(value)(_rebind(value.__func__, old_cls, cell))
+    if isinstance(value, property):
+        return property(*(_rebind(f, old_cls, cell)
+                          for f in (value.fget, value.fset, value.fdel)),
+                        value.__doc__)
+    if not inspect.isfunction(value) or \
+            "__class__" not in value.__code__.co_freevars:
+        return value
+
+    i = value.__code__.co_freevars.index("__class__")
+    if value.__closure__[i].cell_contents is not old_cls:
+        return value
+    closure = value.__closure__[:i] + (cell,) + value.__closure__[i + 1:]
+    new = types.FunctionType(value.__code__, value.__globals__,
+                             value.__name__, value.__defaults__, closure)
+    new.__kwdefaults__ = value.__kwdefaults__
+    new.__dict__.update(value.__dict__)
+    functools.update_wrapper(new, value, updated=())
+    return new
+
+
+def _is_dict_backed(cls):
+    return "__slots__" not in vars(cls)
+
+
+def _own_slots(cls):
+    slots = vars(cls).get("__slots__", ())
+    return (slots,) if isinstance(slots, str) else tuple(slots)
+
+
+def _has_weakref(cls):
+    return any("__weakref__" in _own_slots(k) or
+               ("__weakref__" in vars(k) and k is not object)
+               for k in cls.__mro__)
+
+
+def _collect(cls, names):
+    class_attrs = set()
+    for klass in cls.__mro__:
+        class_attrs.update(vars(klass))
+
+    for value in vars(cls).values():
+        if isinstance(value, (staticmethod, classmethod)):
+            continue  # no `self` to assign through
+        if isinstance(value, property):
+            funcs = [value.fget, value.fset, value.fdel]
+        else:
+            funcs = [value]
+        for f in funcs:
+            if not inspect.isfunction(f):
+                continue
+            for name in _assigned_attrs(f):
+                name = _mangle(name, cls.__name__)
+                if name in names:
+                    continue
+                # `self.value = v` where `value` is a property: the
+                # property's setter does the storing, no slot needed
+                if name in class_attrs and _is_data_descriptor(cls, name):
+                    continue
+                names.append(name)
+
+
+def _is_data_descriptor(cls, name):
+    for klass in cls.__mro__:
+        if name in vars(klass):
+            return hasattr(type(vars(klass)[name]), "__set__")
+    return False
+
+
+def _mangle(name, class_name):
+    if name.startswith("__") and not name.endswith("__"):
+        return "_{}{}".format(class_name.lstrip("_"), name)
+    return name
+
+
+def _assigned_attrs(func):
+    try:
+        return _assigned_attrs_ast(func)
+    except (OSError, TypeError, SyntaxError):
+        return _assigned_attrs_bytecode(func)
+
+
+def _assigned_attrs_ast(func):
+    tree = ast.parse(textwrap.dedent(inspect.getsource(func)))
+    fdef = tree.body[0]
+    if not isinstance(fdef, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        raise TypeError("not a def statement")  # e.g. a lambda
+    if not fdef.args.args:
+        return []
+    self_name = fdef.args.args[0].arg
+
+    def is_self(node):
+        return isinstance(node, ast.Name) and node.id == self_name
+
+    found = []
+    for node in ast.walk(fdef):
+        if isinstance(node, ast.Attribute) and \
+                isinstance(node.ctx, ast.Store) and is_self(node.value):
+            found.append(node.attr)
+        elif isinstance(node, ast.Call) and \
+                isinstance(node.func, ast.Name) and \
+                node.func.id == "setattr" and len(node.args) >= 2 and \
+                is_self(node.args[0]) and \
+                isinstance(node.args[1], ast.Constant) and \
+                isinstance(node.args[1].value, str):
+            found.append(node.args[1].value)
+    return sorted(set(found), key=found.index)
+
+
+def _assigned_attrs_bytecode(func):
+    # no source: every `STORE_ATTR` in the function is taken, which may
+    # slot a few extra names but never misses one set on `self`
+    found = [i.argval for i in dis.get_instructions(func)
+             if i.opname == "STORE_ATTR"]
+    return sorted(set(found), key=found.index)
+
+
+def bytes_per_instance(cls, *args, n=10000, **kwargs):
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        keep = [cls(*args, **kwargs) for _ in range(n)]
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    # the list holding them costs 8 bytes per entry
+    return (after - before) / len(keep) - 8
+
+
+def memory_report(before, after, *args, n=10000, **kwargs):
+    b = bytes_per_instance(before, *args, n=n, **kwargs)
+    a = bytes_per_instance(after, *args, n=n, **kwargs)
+    print("{}: {:.0f} -> {:.0f} bytes/instance ({:.0%} saved)".format(
+        before.__name__, b, a, 1 - a / b))
+    return b, a
+
+
+# ## Examples (the ch07 classes)
+
+
+class Foo:
+    instance_count = 0
+
+    def __init__(self, bar, baz):
+        self.bar = bar
+        self.baz = baz
+        Foo.instance_count += 1
+
+
+class SpecialNumber:
+    def __init__(self, value):
+        self.value = value
+
+    @property
+    def double(self):
+        return self.value * 2
+
+
+class SimpleValue:
+    def __init__(self, value):
+        self.__value = value
+
+    @property
+    def value(self):
+        return self.__value
+
+    @value.setter
+    def value(self, new_value):
+        self.__value = new_value
+
+
+class DictDemo:
+    def __init__(self, value1, **kw):
+        self.value1 = value1
+
+
+class OtherDemo:
+    def __init__(self, foo, bar, **kw):
+        self.foo = foo
+        self.bar = bar
+
+
+class BasesDemo(DictDemo, OtherDemo):
+    def __init__(self, value1, foo, bar):
+        super().__init__(value1=value1, foo=foo, bar=bar)
+        OtherDemo.__init__(self, foo, bar)
+
+
+def main():
+    examples = [
+        (Foo, (1, "Hi")),
+        (SpecialNumber, (42,)),
+        (SimpleValue, ("hello",)),
+        (OtherDemo, ("FOO", "bar")),
+        (BasesDemo, (42, "FOO", "bar")),
+    ]
+    for cls, args in examples:
+        slotted = autoslots(cls)
+        print("{}.__slots__ = {}".format(cls.__name__, slotted.__slots__))
+        memory_report(cls, slotted, *args)
+    # >>> Foo.__slots__ = ('bar', 'baz', '__weakref__')
+    # >>> Foo: 89 -> 57 bytes/instance (36% saved)
+    # >>> SpecialNumber.__slots__ = ('value', '__weakref__')
+    # >>> SpecialNumber: 81 -> 49 bytes/instance (40% saved)
+    # >>> SimpleValue.__slots__ = ('_SimpleValue__value', '__weakref__')
+    # >>> SimpleValue: 81 -> 49 bytes/instance (40% saved)
+    # >>> OtherDemo.__slots__ = ('foo', 'bar', '__weakref__')
+    # >>> OtherDemo: 89 -> 57 bytes/instance (36% saved)
+    # >>> BasesDemo.__slots__ = ('value1', 'foo', 'bar', '__weakref__')
+    # >>> BasesDemo: 97 -> 65 bytes/instance (33% saved)
+
+    # (Python 3.11; its instance dicts are already lazily materialized, so
+    # the gap is wider on older interpreters or once `__dict__` is touched)
+
+    SlottedBases = autoslots(BasesDemo)
+    bd = SlottedBases(42, "FOO", "bar")
+    print(bd.value1, bd.foo, bd.bar, hasattr(bd, "__dict__"))
+    # >>> 42 FOO bar False
+    print([k.__name__ for k in SlottedBases.__mro__])
+    # >>> ['BasesDemo', 'DictDemo', 'OtherDemo', 'object']
+
+
+if __name__ == '__main__':
+    main()
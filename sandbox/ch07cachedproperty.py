@@ -0,0 +1,290 @@
+# # Cached Properties with Declared Dependencies
+
+# ch07's `SpecialNumber.double` and `SimpleValue.value` are recomputed on
+# every access; `functools.cached_property` computes once but never notices
+# when the inputs change (and doesn't work with `__slots__`)
+
+# `@cached(depends=("value",))` does both:
+# - the first read computes and stores the result; later reads return it
+# - writing (or deleting) any attribute named in `depends` clears it
+#   - a dependency that is a `property` (like `SimpleValue.value`) gets its
+#     setter / deleter wrapped
+#   - a plain attribute or a slot gets a small data descriptor in the class
+#     that does the write and then the clearing
+#   - a dependency may itself be `@cached`: clearing cascades
+# - storage:
+#   - classes with a `__dict__`: the value lives in the instance dict under
+#     the property's own name, so a cached read is a plain dict hit and the
+#     descriptor isn't even called
+#   - slotted classes: list a `_<name>_cache` slot, e.g.
+#     `__slots__ = ("value", "_double_cache")`
+# - only writes through the attribute are seen; code that updates an
+#   underlying private field directly (`self._SimpleValue__value = x`) has
+#   to call `invalidate(obj, "value")` itself
+
+_MISSING = object()
+
+
+class cached:
+    def __init__(self, func=None, depends=()):
+        self.depends = (depends,) if isinstance(depends, str) \
+            else tuple(depends)
+        self.func = None
+        if func is not None:
+            self(func)
+
+    def __call__(self, func):
+        # `@cached(depends=...)` passes the function in here
+        self.func = func
+        self.__doc__ = func.__doc__
+        return self
+
+    def __set_name__(self, owner, name):
+        self.name = name
+        slot = "_{}_cache".format(name)
+        if "__dict__" in dir(owner) or not hasattr(owner, "__slots__"):
+            self.slot = None
+        elif slot in vars(owner):
+            self.slot = vars(owner)[slot]
+        else:
+            raise TypeError("slotted class {} needs a {!r} slot for "
+                            "@cached {!r}".format(owner.__name__, slot, name))
+
+        dependents = _dependents(owner)
+        for dep in self.depends:
+            dependents.setdefault(dep, []).append(self)
+            if dep not in vars(owner) or \
+                    not isinstance(vars(owner)[dep], (_Tracked, cached)):
+                _track(owner, dep)
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        if self.slot is None:
+            value = instance.__dict__[self.name] = self.func(instance)
+            return value
+        try:
+            return self.slot.__get__(instance, owner)
+        except AttributeError:
+            value = self.func(instance)
+            self.slot.__set__(instance, value)
+            return value
+
+    def clear(self, instance):
+        if self.slot is None:
+            if instance.__dict__.pop(self.name, _MISSING) is _MISSING:
+                return
+        else:
+            try:
+                self.slot.__delete__(instance)
+            except AttributeError:
+                return
+        # only cascade when something was actually cached
+        invalidate(instance, self.name)
+
+
+class _Tracked:
+    # data descriptor placed over a dependency: does the write the normal
+    # way (property, slot, or instance dict), then clears what depends on it
+    def __init__(self, name, inner, default=_MISSING):
+        self.name = name
+        self.inner = inner
+        self.default = default  # a plain class attribute it replaced
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        if self.inner is None:
+            try:
+                return instance.__dict__[self.name]
+            except KeyError:
+                if self.default is not _MISSING:
+                    return self.default
+                raise AttributeError(self.name) from None
+        return self.inner.__get__(instance, owner)
+
+    def __set__(self, instance, value):
+        if self.inner is None:
+            instance.__dict__[self.name] = value
+        else:
+            self.inner.__set__(instance, value)
+        invalidate(instance, self.name)
+
+    def __delete__(self, instance):
+        if self.inner is None:
+            try:
+                del instance.__dict__[self.name]
+            except KeyError:
+                raise AttributeError(self.name) from None
+        else:
+            self.inner.__delete__(instance)
+        invalidate(instance, self.name)
+
+
+def _dependents(owner):
+    # per class: dependency name -> [cached descriptors]; copied from the
+    # bases so subclasses can add their own without touching the parent
+    if "__dependents__" not in vars(owner):
+        merged = {}
+        for base in reversed(owner.__mro__[1:]):
+            for dep, caches in vars(base).get("__dependents__", {}).items():
+                merged.setdefault(dep, []).extend(caches)
+        type.__setattr__(owner, "__dependents__", merged)
+    return owner.__dependents__
+
+
+def _track(owner, dep):
+    for klass in owner.__mro__:
+        if dep in vars(klass):
+            found = vars(klass)[dep]
+            break
+    else:
+        setattr(owner, dep, _Tracked(dep, None))
+        return
+
+    if hasattr(type(found), "__set__"):
+        setattr(owner, dep, _Tracked(dep, found))
+    elif hasattr(type(found), "__get__"):
+        raise TypeError("can't track {!r}: {} is not a settable attribute"
+                        .format(dep, type(found).__name__))
+    else:
+        setattr(owner, dep, _Tracked(dep, None, default=found))
+
+
+def invalidate(instance, name):
+    for c in type(instance).__dependents__.get(name, ()):
+        c.clear(instance)
+
+
+# ## Examples (ch07's `SpecialNumber` and `SimpleValue`)
+
+
+class SpecialNumber:
+    def __init__(self, value):
+        self.value = value
+
+    @cached(depends="value")
+    def double(self):
+        return self.value * 2
+
+    @cached(depends="double")
+    def quadruple(self):
+        return self.double * 2
+
+
+class SimpleValue:
+    def __init__(self, value):
+        self.__value = value
+
+    @property
+    def value(self):
+        return self.__value
+
+    @value.setter
+    def value(self, new_value):
+        self.__value = new_value
+
+    @cached(depends="value")
+    def shout(self):
+        return self.value.upper() + "!"
+
+
+class SlottedNumber:
+    __slots__ = ("value", "_double_cache")
+
+    def __init__(self, value):
+        self.value = value
+
+    @cached(depends="value")
+    def double(self):
+        return self.value * 2
+
+
+# ## Benchmark
+
+
+class Series:
+    __slots__ = ("values",)
+
+    def __init__(self, values):
+        self.values = values
+
+    @property
+    def stddev(self):
+        return _stddev(self.values)
+
+
+class CachedSeries:
+    def __init__(self, values):
+        self.values = values
+
+    @cached(depends="values")
+    def stddev(self):
+        return _stddev(self.values)
+
+
+class SlottedCachedSeries:
+    __slots__ = ("values", "_stddev_cache")
+
+    def __init__(self, values):
+        self.values = values
+
+    @cached(depends="values")
+    def stddev(self):
+        return _stddev(self.values)
+
+
+def _stddev(values):
+    mean = sum(values) / len(values)
+    return (sum((v - mean) ** 2 for v in values) / len(values)) ** 0.5
+
+
+def main():
+    import timeit
+
+    n = SpecialNumber(21)
+    print(n.double, n.quadruple)
+    n.value = 50
+    print(n.double, n.quadruple)
+    # >>> 42 84
+    # >>> 100 200
+
+    s = SimpleValue("hello")
+    print(s.shout)
+    s.value = "goodbye"
+    print(s.shout)
+    # >>> HELLO!
+    # >>> GOODBYE!
+
+    sn = SlottedNumber(4)
+    print(sn.double)
+    sn.value = 5
+    print(sn.double)
+    # >>> 8
+    # >>> 10
+
+    # repeated reads of a standard deviation over 1000 values; the last
+    # column sets `values` before every read, so every read recomputes
+    data = list(range(1000))
+    n = 10000
+    print("{:<20} {:>12} {:>14}".format("", "read (us)", "set+read (us)"))
+    for cls in (Series, CachedSeries, SlottedCachedSeries):
+        o = cls(data)
+        read = min(timeit.repeat(lambda: o.stddev, number=n, repeat=3))
+        write = min(timeit.repeat(
+            "o.values = data; o.stddev", globals=locals(), number=n // 10,
+            repeat=3))
+        print("{:<20} {:>12.3f} {:>14.3f}".format(
+            cls.__name__, read / n * 1e6, write / (n // 10) * 1e6))
+    # >>>                         read (us)  set+read (us)
+    # >>> Series                    143.787        149.176
+    # >>> CachedSeries                0.095        134.778
+    # >>> SlottedCachedSeries         0.439        170.531
+
+    # cached reads are a dict hit (or one descriptor call when slotted);
+    # when every read follows a write, caching buys nothing and the
+    # invalidation adds a little on top
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+# # Schema-Driven Class Factory
+
+# ch07's metaclass section builds `MetaDemo2` by `exec`-ing a class body
+# string into a dict and calling `type(...)`
+
+# `make_class(name, fields, ...)` does the same, but writes the class body
+# from a field schema, so every method is straight-line code specialized to
+# those fields (no loops over field lists, no `getattr` by name):
+# - `__slots__`, `__init__` (with defaults), `__repr__`, `__eq__`,
+#   `__hash__`, and `__lt__`/`__le__`/`__gt__`/`__ge__` when `order=True`
+# - `fields` is a sequence of names or `(name, default)` pairs; names that
+#   would break the generated code (keywords, `self`, duplicates, ...) are
+#   a `ValueError`, a required field after a defaulted one a `TypeError`
+# - generated classes are cached by (name, fields, options), so each schema
+#   is built once per process; `make_class.cache_info()` shows the hits
+# - `source(cls)` returns the generated code, handy for reading what `exec`
+#   compiled
+
+import functools
+import keyword
+
+_NO_DEFAULT = object()
+# names the generated code itself uses
+_RESERVED = frozenset(("self", "other", "_defaults", "_setattr"))
+
+
+def _check_name(name, what):
+    if not isinstance(name, str) or not name.isidentifier() or \
+            keyword.iskeyword(name) or name in _RESERVED:
+        raise ValueError("invalid {} name: {!r}".format(what, name))
+
+
+def _normalize(fields):
+    result = []
+    seen = set()
+    for f in fields:
+        name, default = (f, _NO_DEFAULT) if isinstance(f, str) else f
+        _check_name(name, "field")
+        if name in seen:
+            raise ValueError("duplicate field name: {!r}".format(name))
+        seen.add(name)
+        if default is _NO_DEFAULT and result and \
+                result[-1][1] is not _NO_DEFAULT:
+            raise TypeError("non-default field {!r} follows default field "
+                            "{!r}".format(name, result[-1][0]))
+        result.append((name, default))
+    return tuple(result)
+
+
+def _class_source(name, fields, eq, order, frozen):
+    names = [f for f, _ in fields]
+    lines = ["class {}:".format(name),
+             "    __slots__ = {!r}".format(tuple(names)),
+             "    __fields__ = {!r}".format(tuple(names)),
+             ""]
+
+    params = ", ".join(
+        f if d is _NO_DEFAULT else "{0}=_defaults[{0!r}]".format(f)
+        for f, d in fields)
+    lines.append("    def __init__(self{}):".format(
+        ", " + params if params else ""))
+    if frozen:
+        body = ["_setattr(self, {0!r}, {0})".format(f) for f in names]
+    else:
+        body = ["self.{0} = {0}".format(f) for f in names]
+    lines += ["        " + b for b in body or ["pass"]]
+    lines.append("")
+
+    lines.append("    def __repr__(self):")
+    lines.append("        return f\"{}({})\"".format(name, ", ".join(
+        "{0}={{self.{0}!r}}".format(f) for f in names)))
+    lines.append("")
+
+    if eq:
+        # field-by-field `and` chain: no tuples built per comparison
+        cmp = " and ".join("self.{0} == other.{0}".format(f)
+                           for f in names) or "True"
+        lines += [
+            "    def __eq__(self, other):",
+            "        if other.__class__ is not self.__class__:",
+            "            return NotImplemented",
+            "        return {}".format(cmp),
+            "",
+        ]
+        if frozen:
+            lines += [
+                "    def __hash__(self):",
+                "        return hash(({}))".format("".join(
+                    "self.{}, ".format(f) for f in names)),
+                "",
+            ]
+        else:
+            # mutable + __eq__ -> unhashable, same as dataclasses
+            lines += ["    __hash__ = None", ""]
+
+    if order:
+        # lexicographic, like comparing tuples, but unrolled: return at the
+        # first field that differs
+        for op, sym in (("lt", "<"), ("le", "<="), ("gt", ">"),
+                        ("ge", ">=")):
+            lines += [
+                "    def __{}__(self, other):".format(op),
+                "        if other.__class__ is not self.__class__:",
+                "            return NotImplemented",
+            ]
+            for f in names[:-1]:
+                lines += [
+                    "        if self.{0} != other.{0}:".format(f),
+                    "            return self.{0} {1} other.{0}".format(
+                        f, sym.rstrip("=")),
+                ]
+            if names:
+                lines.append("        return self.{0} {1} other.{0}".format(
+                    names[-1], sym))
+            else:
+                lines.append("        return {}".format(sym in ("<=", ">=")))
+            lines.append("")
+
+    if frozen:
+        lines += [
+            "    def __setattr__(self, name, value):",
+            "        raise AttributeError("
+            "f\"cannot assign to field {name!r}\")",
+            "",
+            "    def __delattr__(self, name):",
+            "        raise AttributeError("
+            "f\"cannot delete field {name!r}\")",
+            "",
+        ]
+    return "\n".join(lines)
+
+
+@functools.lru_cache(maxsize=None)
+def _make_class(name, fields, eq, order, frozen, module, default_types):
+    # `default_types` is only part of the cache key: `0 == False` and
+    # `1 == 1.0`, so the defaults alone would hand `("on", 0)` the class
+    # built for `("on", False)`
+    src = _class_source(name, fields, eq, order, frozen)
+    namespace = {
+        "_defaults": {f: d for f, d in fields if d is not _NO_DEFAULT},
+        "_setattr": object.__setattr__,
+        "__name__": module,
+    }
+    exec(src, namespace)
+    cls = namespace[name]
+    cls.__source__ = src
+    return cls
+
+
+def make_class(name, fields, eq=True, order=False, frozen=False,
+               module=__name__):
+    # defaults must be hashable to be part of the cache key
+    _check_name(name, "class")
+    fields = _normalize(fields)
+    return _make_class(name, fields, eq, order, frozen, module,
+                       tuple(type(d) for _, d in fields))
+
+
+make_class.cache_info = _make_class.cache_info
+
+
+def source(cls):
+    return cls.__source__
+
+
+# ## Benchmark
+
+
+class HandPoint:
+    __slots__ = ("x", "y", "z")
+
+    def __init__(self, x, y, z=0):
+        self.x = x
+        self.y = y
+        self.z = z
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return (self.x, self.y, self.z) == (other.x, other.y, other.z)
+
+    def __lt__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return (self.x, self.y, self.z) < (other.x, other.y, other.z)
+
+
+def main():
+    import dataclasses
+    import timeit
+
+    Point = make_class("Point", ["x", "y", ("z", 0)], order=True)
+    print(source(Point))
+    # >>> class Point:
+    # >>>     __slots__ = ('x', 'y', 'z')
+    # >>>     __fields__ = ('x', 'y', 'z')
+    # >>>
+    # >>>     def __init__(self, x, y, z=_defaults['z']):
+    # >>>         self.x = x
+    # >>>         self.y = y
+    # >>>         self.z = z
+    # >>> ...
+
+    print(Point(1, 2), Point(1, 2) == Point(1, 2), Point(1, 2) < Point(1, 3))
+    # >>> Point(x=1, y=2, z=0) True True
+
+    assert make_class("Point", ["x", "y", ("z", 0)], order=True) is Point
+    # equal defaults of different types are different schemas
+    Flag = make_class("Flag", [("on", False)])
+    assert make_class("Flag", [("on", 0)])().on is not Flag().on
+    print(make_class.cache_info())
+    # >>> CacheInfo(hits=1, misses=3, maxsize=None, currsize=3)
+
+    @dataclasses.dataclass(order=True)
+    class DataPoint:
+        x: int
+        y: int
+        z: int = 0
+
+    @dataclasses.dataclass(order=True, slots=True)
+    class SlottedDataPoint:
+        x: int
+        y: int
+        z: int = 0
+
+    n = 500000
+    print("{:<18} {:>8} {:>8} {:>8}".format("", "init", "eq", "lt"))
+    for cls in (HandPoint, DataPoint, SlottedDataPoint, Point):
+        a, b = cls(1, 2, 3), cls(1, 2, 4)  # noqa
+        init = timeit.timeit("cls(1, 2, 3)", globals=locals(), number=n)
+        eq = timeit.timeit("a == b", globals=locals(), number=n)
+        lt = timeit.timeit("a < b", globals=locals(), number=n)
+        print("{:<18} {:>7.3f}s {:>7.3f}s {:>7.3f}s".format(
+            cls.__name__, init, eq, lt))
+    # >>>                        init       eq       lt
+    # >>> HandPoint            0.159s   0.145s   0.150s
+    # >>> DataPoint            0.183s   0.141s   0.151s
+    # >>> SlottedDataPoint     0.163s   0.145s   0.147s
+    # >>> Point                0.162s   0.098s   0.091s
+
+    # construction matches a hand-written slotted class; comparisons win
+    # because the unrolled code never builds the two tuples that hand-written
+    # classes and dataclasses compare
+
+
+if __name__ == '__main__':
+    main()
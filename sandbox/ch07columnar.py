@@ -0,0 +1,471 @@
+# # Columnar (Struct-of-Arrays) Tables
+
+# tens of millions of records shaped like ch07's `Foo(bar, baz)` or ch09's
+# `Foo(bar, bat)` cost an object (plus a dict, plus boxed field values) per
+# record
+
+# `Table` stores each field as one column instead:
+# - numeric fields: an `array.array` of raw machine values (typecode per
+#   field, e.g. "q" for int64, "d" for double)
+# - string fields: `StringColumn`, a single utf-8 `bytearray` plus an
+#   `array("Q")` of offsets; string `i` is `data[offsets[i]:offsets[i + 1]]`
+# - `table[i]` returns a `Row`, a two-slot proxy (table, index) that reads
+#   the columns on attribute access; rows aren't cached, so they cost
+#   nothing until used
+# - column operations run over the whole column through `map` /
+#   `itertools.compress` with `operator` functions, so the per-element loop
+#   stays in C:
+#   - comparisons (`t.baz > 0.5`) return a `Mask` (one byte per row)
+#   - masks combine with `&`, `|`, `~`
+#   - arithmetic (`t.bar * 2`, `t.bar + t.baz`) returns a new column
+#   - `t.filter(mask)` returns a new `Table` with the selected rows
+
+import array
+import itertools
+import operator
+
+STR = "str"
+
+
+class Mask:
+    __slots__ = ("bits",)
+
+    def __init__(self, bits):
+        self.bits = bits  # bytes, one 0/1 per row
+
+    def __len__(self):
+        return len(self.bits)
+
+    def __and__(self, other):
+        return Mask(bytes(map(operator.and_, self.bits, other.bits)))
+
+    def __or__(self, other):
+        return Mask(bytes(map(operator.or_, self.bits, other.bits)))
+
+    def __invert__(self):
+        return Mask(self.bits.translate(_INVERT))
+
+    def count(self):
+        return self.bits.count(1)
+
+    def indices(self):
+        return array.array("Q", itertools.compress(range(len(self.bits)),
+                                                   self.bits))
+
+
+_INVERT = bytes([1, 0]) + bytes(254)
+
+
+class Column:
+    __slots__ = ("values",)
+
+    def __init__(self, typecode, values=()):
+        self.values = values if isinstance(values, array.array) \
+            else array.array(typecode, values)
+
+    @property
+    def typecode(self):
+        return self.values.typecode
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        return self.values[i]
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def append(self, value):
+        self.values.append(value)
+
+    def truncate(self, n):
+        del self.values[n:]
+
+    def take(self, mask):
+        return Column(self.typecode, array.array(
+            self.typecode, itertools.compress(self.values, mask.bits)))
+
+    def sum(self, mask=None):
+        if mask is None:
+            return sum(self.values)
+        return sum(itertools.compress(self.values, mask.bits))
+
+    def min(self):
+        return min(self.values)
+
+    def max(self):
+        return max(self.values)
+
+    def map(self, func, typecode=None):
+        return Column(typecode or self.typecode, map(func, self.values))
+
+    def nbytes(self):
+        return self.values.itemsize * len(self.values)
+
+    def _compare(self, op, other):
+        return Mask(bytes(map(op, self.values, _operand(other))))
+
+    def _arith(self, op, other):
+        result = array.array("d" if self.typecode in "fd" or
+                             isinstance(other, float) or
+                             getattr(other, "typecode", "q") in "fd"
+                             else self.typecode,
+                             map(op, self.values, _operand(other)))
+        return Column(result.typecode, result)
+
+    def __lt__(self, other):
+        return self._compare(operator.lt, other)
+
+    def __le__(self, other):
+        return self._compare(operator.le, other)
+
+    def __gt__(self, other):
+        return self._compare(operator.gt, other)
+
+    def __ge__(self, other):
+        return self._compare(operator.ge, other)
+
+    def __eq__(self, other):
+        return self._compare(operator.eq, other)
+
+    def __ne__(self, other):
+        return self._compare(operator.ne, other)
+
+    __hash__ = None
+
+    def __add__(self, other):
+        return self._arith(operator.add, other)
+
+    def __sub__(self, other):
+        return self._arith(operator.sub, other)
+
+    def __mul__(self, other):
+        return self._arith(operator.mul, other)
+
+    def __truediv__(self, other):
+        result = array.array("d", map(operator.truediv, self.values,
+                                      _operand(other)))
+        return Column("d", result)
+
+
+def _operand(other):
+    if isinstance(other, Column):
+        return other.values
+    if isinstance(other, StringColumn):
+        return iter(other)
+    return itertools.repeat(other)
+
+
+class StringColumn:
+    __slots__ = ("data", "offsets")
+
+    def __init__(self, values=()):
+        self.data = bytearray()
+        self.offsets = array.array("Q", [0])
+        for v in values:
+            self.append(v)
+
+    @property
+    def typecode(self):
+        return STR
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        offsets = self.offsets
+        if i < 0:
+            i += len(offsets) - 1
+        return self.data[offsets[i]:offsets[i + 1]].decode()
+
+    def __iter__(self):
+        data = self.data
+        offsets = self.offsets
+        return (data[a:b].decode() for a, b in zip(offsets, offsets[1:]))
+
+    def append(self, value):
+        try:
+            encoded = value.encode()
+        except AttributeError:
+            raise TypeError("a str is required, not {}".format(
+                type(value).__name__)) from None
+        self.data += encoded
+        self.offsets.append(len(self.data))
+
+    def truncate(self, n):
+        del self.offsets[n + 1:]
+        del self.data[self.offsets[-1]:]
+
+    def take(self, mask):
+        return StringColumn(itertools.compress(self, mask.bits))
+
+    def map(self, func, typecode=None):
+        if typecode is None or typecode == STR:
+            return StringColumn(map(func, self))
+        return Column(typecode, map(func, self))
+
+    def nbytes(self):
+        return len(self.data) + self.offsets.itemsize * len(self.offsets)
+
+    def _compare(self, op, other):
+        if isinstance(other, str) and op in (operator.eq, operator.ne):
+            # compare encoded bytes; saves decoding every row
+            target = other.encode()
+            data = self.data
+            offsets = self.offsets
+            bits = bytes(op(data[a:b], target)
+                         for a, b in zip(offsets, offsets[1:]))
+            return Mask(bits)
+        return Mask(bytes(map(op, self, _operand(other))))
+
+    def __eq__(self, other):
+        return self._compare(operator.eq, other)
+
+    def __ne__(self, other):
+        return self._compare(operator.ne, other)
+
+    def __lt__(self, other):
+        return self._compare(operator.lt, other)
+
+    def __gt__(self, other):
+        return self._compare(operator.gt, other)
+
+    __hash__ = None
+
+
+def _make_column(typecode):
+    return StringColumn() if typecode == STR else Column(typecode)
+
+
+class Row:
+    __slots__ = ("_table", "_index")
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    def __getattr__(self, name):
+        try:
+            column = self._table.columns[name]
+        except KeyError:
+            raise AttributeError(name) from None
+        return column[self._index]
+
+    def __setattr__(self, name, value):
+        if name in Row.__slots__:
+            object.__setattr__(self, name, value)
+        elif name in self._table.columns:
+            column = self._table.columns[name]
+            if isinstance(column, StringColumn):
+                raise AttributeError("string columns are append-only")
+            column.values[self._index] = value
+        else:
+            raise AttributeError(name)
+
+    def astuple(self):
+        i = self._index
+        return tuple(c[i] for c in self._table.columns.values())
+
+    def __repr__(self):
+        return "Row({})".format(", ".join(
+            "{}={!r}".format(k, v)
+            for k, v in zip(self._table.columns, self.astuple())))
+
+
+class Table:
+    def __init__(self, schema, columns=None):
+        # schema: [(name, typecode), ...] where typecode is an `array`
+        # typecode or STR
+        self.schema = tuple(schema)
+        self.columns = columns if columns is not None else {
+            name: _make_column(code) for name, code in self.schema}
+
+    @classmethod
+    def from_rows(cls, schema, rows):
+        t = cls(schema)
+        t.extend(rows)
+        return t
+
+    def __len__(self):
+        return len(next(iter(self.columns.values())))
+
+    def __getitem__(self, i):
+        if isinstance(i, str):
+            return self.columns[i]
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("table index out of range")
+        return Row(self, i)
+
+    def __getattr__(self, name):
+        # `t.bar` -> the `bar` column
+        try:
+            return self.__dict__["columns"][name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield Row(self, i)
+
+    def _check_row(self, row):
+        # a short or long row would leave the columns different lengths
+        if len(row) != len(self.columns):
+            raise ValueError("expected {} values per row, got {}".format(
+                len(self.columns), len(row)))
+
+    def _rollback(self):
+        # a value the column can't store (`array` raises TypeError or
+        # OverflowError) fails after the columns before it took theirs;
+        # drop that partial row
+        n = min(len(c) for c in self.columns.values())
+        for column in self.columns.values():
+            column.truncate(n)
+
+    def append(self, *values):
+        self._check_row(values)
+        try:
+            for column, value in zip(self.columns.values(), values):
+                column.append(value)
+        except BaseException:
+            self._rollback()
+            raise
+
+    def extend(self, rows):
+        appends = [c.append for c in self.columns.values()]
+        width = len(appends)
+        try:
+            for row in rows:
+                if len(row) != width:
+                    self._check_row(row)
+                for append, value in zip(appends, row):
+                    append(value)
+        except BaseException:
+            # the rows before the bad one stay, as with `list.extend`
+            self._rollback()
+            raise
+
+    def filter(self, mask):
+        return Table(self.schema, {name: c.take(mask)
+                                   for name, c in self.columns.items()})
+
+    def nbytes(self):
+        return sum(c.nbytes() for c in self.columns.values())
+
+
+# ## Benchmark
+
+
+class Foo:
+    def __init__(self, bar, baz, bat):
+        self.bar = bar
+        self.baz = baz
+        self.bat = bat
+
+
+class SlottedFoo:
+    __slots__ = ("bar", "baz", "bat")
+
+    def __init__(self, bar, baz, bat):
+        self.bar = bar
+        self.baz = baz
+        self.bat = bat
+
+
+def _traced(build):
+    import tracemalloc
+    tracemalloc.start()
+    try:
+        result = build()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return result, size
+
+
+def main():
+    import random
+    import time
+
+    # a bad row leaves the table as it was, whichever value is bad
+    t = Table([("a", "q"), ("b", "d"), ("c", STR)])
+    t.append(1, 0.5, "x")
+    for bad in ((2, "x", "y"), (2, 0.5, 3), ("x", 0.5, "y"), (2, 0.5)):
+        for add in (lambda: t.append(*bad), lambda: t.extend([bad])):
+            try:
+                add()
+            except (TypeError, ValueError):
+                pass
+            assert [len(c) for c in t.columns.values()] == [1, 1, 1]
+    try:
+        t.extend([(2, 1.5, "y"), (3, "bad", "z")])
+    except TypeError:
+        pass
+    print(t[1], len(t), [len(c) for c in t.columns.values()])
+    # >>> Row(a=2, b=1.5, c='y') 2 [2, 2, 2]
+
+    n = 1000000
+    schema = [("bar", "q"), ("baz", "d"), ("bat", STR)]
+
+    def records():
+        # fresh values per record, as if each was read from storage
+        rnd = random.Random(42)
+        for _ in range(n):
+            yield (rnd.randrange(10 ** 9), rnd.random(),
+                   "tag{}".format(rnd.randrange(1000)))
+
+    objs, objs_size = _traced(lambda: [Foo(*r) for r in records()])
+    slotted, slotted_size = _traced(
+        lambda: [SlottedFoo(*r) for r in records()])
+    table, table_size = _traced(lambda: Table.from_rows(schema, records()))
+
+    print("{:<10} {:>8} {:>10} {:>10}".format(
+        "", "MB", "sum (s)", "where (s)"))
+
+    def timed(scan):
+        start = time.perf_counter()
+        total = scan()
+        return total, time.perf_counter() - start
+
+    # two full scans: the sum of `bar`, and the sum of `bar` where
+    # `baz > 0.5`
+    results = []
+    for label, size, total, where in (
+            ("objects", objs_size,
+             lambda: sum(o.bar for o in objs),
+             lambda: sum(o.bar for o in objs if o.baz > 0.5)),
+            ("slotted", slotted_size,
+             lambda: sum(o.bar for o in slotted),
+             lambda: sum(o.bar for o in slotted if o.baz > 0.5)),
+            ("table", table_size,
+             lambda: table.bar.sum(),
+             lambda: table.bar.sum(table.baz > 0.5))):
+        a, t_total = timed(total)
+        b, t_where = timed(where)
+        results.append((a, b))
+        print("{:<10} {:>8.1f} {:>10.3f} {:>10.3f}".format(
+            label, size / 1e6, t_total, t_where))
+    assert len(set(results)) == 1
+    # >>>                  MB    sum (s)  where (s)
+    # >>> objects       211.3      0.030      0.040
+    # >>> slotted       171.3      0.027      0.036
+    # >>> table          30.9      0.019      0.075
+
+    # - 6.8x smaller than plain objects, 5.5x smaller than slotted ones
+    # - a scan over one column beats walking the objects
+    # - filtered scans are slower: the comparison has to box every `baz`
+    #   back into a float before `operator.gt` can see it, which objects
+    #   (already holding boxed floats) don't pay; without NumPy, that is
+    #   the price of the unboxed storage
+
+    r = table[0]
+    print(r.bar == objs[0].bar, r.bat == objs[0].bat)
+    # >>> True True
+    print(len(table.filter((table.baz > 0.5) & (table.bat == "tag7"))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+# # Per-Type Cached Dispatch
+
+# ch07's `Root` / `Branch1` / `Branch2` / `Leaf` diamond and the
+# `AbstractDemo` / `RegisterDemo` examples lean on `isinstance` and
+# `issubclass`; against an ABC those go through `__subclasscheck__`, which
+# gets slower as virtual subclasses are `register`-ed
+
+# `typedispatch()` resolves a handler once per *concrete* type and keeps it
+# in a plain dict, so steady-state dispatch is one dict lookup on
+# `type(obj)`
+# - `describe = typedispatch(default)` returns the dispatching function
+# - `describe.register(cls, handler)` (or `@describe.register(cls)`) adds a
+#   handler
+#   for `cls` and its subclasses, real or virtual
+# - resolution picks the most specific registered class: one that none of
+#   the other matches is a subclass of; ties go to the earliest registered
+# - invalidation:
+#   - registering a handler clears the cache
+#   - `ABCMeta.register(...)` anywhere bumps `abc.get_cache_token()`; the
+#     token is compared on each call (only when an ABC handler exists, the
+#     same trick `functools.singledispatch` uses)
+#   - a new subclass is a new type, so it is simply a cache miss
+#   - changing `__bases__` of an existing class can't be seen cheaply:
+#     call `invalidate()`
+
+import abc
+
+_get_cache_token = abc.get_cache_token
+
+
+def typedispatch(default=None):
+    # returns a plain function (not an instance with `__call__`: a closure
+    # call is several times cheaper), with `register`, `resolve`,
+    # `invalidate` and `registry` attached, like `functools.singledispatch`
+    registry = {}
+    cache = {}
+    has_abcs = False
+    token = None
+
+    def register(cls, handler=None):
+        nonlocal has_abcs
+        if handler is None:
+            return lambda handler: register(cls, handler)
+        registry[cls] = handler
+        has_abcs = has_abcs or isinstance(cls, abc.ABCMeta)
+        invalidate()
+        return handler
+
+    def invalidate():
+        nonlocal token
+        cache.clear()
+        token = _get_cache_token()
+
+    def resolve(cls):
+        if has_abcs and token != _get_cache_token():
+            invalidate()
+        try:
+            return cache[cls]
+        except KeyError:
+            handler = cache[cls] = _find(registry, cls, default)
+            return handler
+
+    def dispatch(obj, *args, **kwargs):
+        if has_abcs and token != _get_cache_token():
+            invalidate()
+        try:
+            handler = cache[obj.__class__]
+        except KeyError:
+            handler = resolve(obj.__class__)
+        return handler(obj, *args, **kwargs)
+
+    dispatch.register = register
+    dispatch.resolve = resolve
+    dispatch.invalidate = invalidate
+    dispatch.registry = registry
+    return dispatch
+
+
+def _find(registry, cls, default):
+    # real base classes first, in MRO order: that's the common case and
+    # never needs `__subclasscheck__`
+    for base in cls.__mro__:
+        if base in registry and not isinstance(base, abc.ABCMeta):
+            exact = base
+            break
+    else:
+        exact = None
+
+    matches = [c for c in registry if issubclass(cls, c)]
+    if not matches:
+        if default is None:
+            raise TypeError("no handler for {}".format(cls.__name__))
+        return default
+    best = [c for c in matches
+            if not any(o is not c and issubclass(o, c) for o in matches)]
+    if exact is not None and exact in best:
+        return registry[exact]
+    return registry[best[0]]
+
+
+# ## Example (the ch07 classes)
+
+
+class Root:
+    pass
+
+
+class Branch1(Root):
+    pass
+
+
+class Branch2(Root):
+    pass
+
+
+class Leaf(Branch1, Branch2):
+    pass
+
+
+class AbstractDemo(metaclass=abc.ABCMeta):
+    pass
+
+
+class RegisterDemo:
+    pass
+
+
+AbstractDemo.register(RegisterDemo)
+
+
+def on_root(obj):
+    return "root"
+
+
+def on_branch1(obj):
+    return "branch1"
+
+
+def on_branch2(obj):
+    return "branch2"
+
+
+def on_leaf(obj):
+    return "leaf"
+
+
+def on_abstract(obj):
+    return "abstract"
+
+
+def on_other(obj):
+    return "other"
+
+
+HANDLERS = ((Root, on_root), (Branch1, on_branch1), (Branch2, on_branch2),
+            (Leaf, on_leaf), (AbstractDemo, on_abstract))
+
+
+def isinstance_chain(obj):
+    # the hand-written type switch, most specific class first
+    if isinstance(obj, Leaf):
+        return on_leaf(obj)
+    elif isinstance(obj, Branch1):
+        return on_branch1(obj)
+    elif isinstance(obj, Branch2):
+        return on_branch2(obj)
+    elif isinstance(obj, Root):
+        return on_root(obj)
+    elif isinstance(obj, AbstractDemo):
+        return on_abstract(obj)
+    return on_other(obj)
+
+
+def main():
+    import functools
+    import random
+    import timeit
+
+    describe = typedispatch(default=on_other)
+    for cls, handler in HANDLERS:
+        describe.register(cls, handler)
+
+    print(describe(Leaf()), describe(RegisterDemo()), describe(1))
+    # >>> leaf abstract other
+
+    # registering a virtual subclass later is picked up on the next call
+    class Late:
+        pass
+
+    print(describe(Late()))
+    AbstractDemo.register(Late)
+    print(describe(Late()))
+    # >>> other
+    # >>> abstract
+
+    single = functools.singledispatch(on_other)
+    for cls, handler in HANDLERS:
+        single.register(cls, handler)
+
+    # lots of virtual subclasses make ABC checks slower
+    for i in range(200):
+        AbstractDemo.register(type("Virtual{}".format(i), (), {}))
+
+    rnd = random.Random(3)
+    kinds = [Root, Branch1, Branch2, Leaf, RegisterDemo, Late, int, str]
+    stream = [rnd.choice(kinds)() for _ in range(100000)]
+    assert [describe(o) for o in stream] == \
+        [isinstance_chain(o) for o in stream]
+
+    for label, fx in (("isinstance chain", isinstance_chain),
+                      ("singledispatch", single),
+                      ("typedispatch", describe)):
+        t = min(timeit.repeat(lambda: [fx(o) for o in stream],
+                              number=5, repeat=5))
+        print("{:<18} {:.3f}s".format(label, t))
+    # >>> isinstance chain   0.322s
+    # >>> singledispatch     0.215s
+    # >>> typedispatch       0.170s
+
+    # (best of 5; 100,000 objects x 5 passes) the chain's cost grows with
+    # its length and the objects that fall through to the end (`int`,
+    # `str`), while the cached lookup costs the same for every type
+
+
+if __name__ == '__main__':
+    main()
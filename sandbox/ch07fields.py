@@ -0,0 +1,290 @@
+# # Typed Field Descriptors over `__slots__`
+
+# ch07's `DescriptorProperty` stores each value with
+# `setattr(instance, "_" + name, value)`: a string-keyed attribute lookup
+# plus an instance `__dict__` write on every access
+
+# here, `@fields` rebuilds the class with `__slots__`, and each `Field`
+# reads / writes its value through the slot's own member descriptor
+# (`cls.__dict__["_name"]`), a C-level accessor with no dict involved
+# - `Field(type=..., min=..., max=..., default=...)`; all optional
+# - the `Field` objects are kept in `cls.__fields__`; the class attribute
+#   itself becomes a `property` wrapping the slot accessors
+# - validation runs only on set
+# - the generated `__init__` takes inherited fields first, then the class's
+#   own, and raises `TypeError` for required fields left out
+# - `@fields(validate=False)` (or `VALIDATE = False` before the class is
+#   defined) drops the `Field` wrappers entirely: the public names *are*
+#   the slots, so access costs the same as a plain slotted attribute
+# - `VALIDATE` follows `__debug__`, so `python -O` gets direct slots
+
+import types
+
+from ch07autoslots import _rebind
+
+VALIDATE = __debug__
+
+_MISSING = object()
+
+
+class Field:
+    def __init__(self, type=None, min=None, max=None, default=_MISSING):
+        self.type = type
+        self.min = min
+        self.max = max
+        self.default = default
+        self.name = None
+        self.slot = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+        self.slot = "_" + name
+
+    def validate(self, value):
+        if self.type is not None and not isinstance(value, self.type):
+            raise TypeError("{} must be {}, not {}".format(
+                self.name, _type_name(self.type), type(value).__name__))
+        if self.min is not None and value < self.min:
+            raise ValueError("{} must be >= {}, got {!r}".format(
+                self.name, self.min, value))
+        if self.max is not None and value > self.max:
+            raise ValueError("{} must be <= {}, got {!r}".format(
+                self.name, self.max, value))
+
+    def accessor(self, member):
+        # `member` is the slot's member descriptor on the rebuilt class;
+        # `property` with C-level fget/fset avoids a Python-level `__get__`
+        # call on every read (and on every write, when nothing is validated)
+        if self.type is None and self.min is None and self.max is None:
+            return property(member.__get__, member.__set__)
+
+        validate = self.validate
+        set_slot = member.__set__
+
+        def set_checked(instance, value):
+            validate(value)
+            set_slot(instance, value)
+
+        return property(member.__get__, set_checked)
+
+
+def _type_name(t):
+    if isinstance(t, tuple):
+        return " or ".join(x.__name__ for x in t)
+    return t.__name__
+
+
+def fields(cls=None, validate=None):
+    # usable as `@fields` or `@fields(validate=False)`
+    if cls is None:
+        return lambda cls: _build(cls, validate)
+    return _build(cls, validate)
+
+
+def _build(cls, validate):
+    if validate is None:
+        validate = VALIDATE
+
+    declared = [(k, v) for k, v in vars(cls).items() if isinstance(v, Field)]
+    names = [k for k, _ in declared]
+
+    # methods using zero-argument `super()` get a `__class__` cell for the
+    # rebuilt class, as in ch07autoslots
+    cell = types.CellType()
+    body = {k: _rebind(v, cls, cell) for k, v in vars(cls).items()
+            if k not in names and k not in ("__dict__", "__weakref__")}
+    body["__slots__"] = tuple(f.slot for _, f in declared) if validate \
+        else tuple(names)
+    # inherited fields come first in `__init__`, as with dataclasses; a
+    # redeclared field keeps its base's position
+    all_fields = {}
+    for base in reversed(cls.__mro__[1:]):
+        all_fields.update(getattr(base, "__fields__", {}))
+    all_fields.update(declared)
+    body["__fields__"] = all_fields
+    if "__init__" not in body:
+        body["__init__"] = _make_init(list(all_fields.items()))
+
+    new_cls = type(cls)(cls.__name__, cls.__bases__, body)
+    new_cls.__qualname__ = cls.__qualname__
+    cell.cell_contents = new_cls
+
+    if validate:
+        for name, f in declared:
+            setattr(new_cls, name, f.accessor(new_cls.__dict__[f.slot]))
+    return new_cls
+
+
+def _make_init(declared):
+    defaults = {name: f.default for name, f in declared
+                if f.default is not _MISSING}
+
+    def __init__(self, *args, **kwargs):
+        if len(args) > len(declared):
+            raise TypeError("expected at most {} arguments, got {}".format(
+                len(declared), len(args)))
+        for (name, _), value in zip(declared, args):
+            setattr(self, name, value)
+        missing = []
+        for name, _ in declared[len(args):]:
+            if name in kwargs:
+                setattr(self, name, kwargs.pop(name))
+            elif name in defaults:
+                setattr(self, name, defaults[name])
+            else:
+                missing.append(name)
+        if missing:
+            raise TypeError("missing required field(s): {}".format(
+                ", ".join(missing)))
+        if kwargs:
+            raise TypeError("unexpected field(s): {}".format(
+                ", ".join(sorted(kwargs))))
+
+    return __init__
+
+
+# ## Example
+
+
+@fields
+class Point:
+    x = Field(type=(int, float))
+    y = Field(type=(int, float))
+    label = Field(type=str, default="")
+
+
+@fields
+class Reading:
+    sensor = Field()
+    value = Field(type=float, min=0.0, max=100.0)
+
+
+# ## Benchmark
+
+
+class Plain:
+    def __init__(self, v):
+        self.v = v
+
+
+class Slotted:
+    __slots__ = ("v",)
+
+    def __init__(self, v):
+        self.v = v
+
+
+class WithProperty:
+    def __init__(self, v):
+        self._v = v
+
+    @property
+    def v(self):
+        return self._v
+
+    @v.setter
+    def v(self, value):
+        self._v = value
+
+
+class DescriptorProperty(object):
+    # ch07's version, minus the print calls
+    def __init__(self, name, value):
+        self.name = "_" + name
+        self.default = value
+
+    def __get__(self, instance, cls):
+        return getattr(instance, self.name, self.default)
+
+    def __set__(self, instance, value):
+        setattr(instance, self.name, value)
+
+
+class WithDescriptorProperty:
+    v = DescriptorProperty("v", 0)
+
+    def __init__(self, v):
+        self.v = v
+
+
+@fields
+class WithField:
+    v = Field()
+
+
+@fields
+class WithTypedField:
+    v = Field(type=int, min=0)
+
+
+@fields(validate=False)
+class WithFieldProduction:
+    v = Field(type=int, min=0)
+
+
+def main():
+    import timeit
+
+    p = Point(1, 2.5)
+    print(p.x, p.y, repr(p.label), Point.__slots__)
+    # >>> 1 2.5 '' ('_x', '_y', '_label')
+
+    try:
+        Reading("t1", 101.0)
+    except ValueError as e:
+        print(e)
+    # >>> value must be <= 100.0, got 101.0
+
+    try:
+        p.x = "1"
+    except TypeError as e:
+        print(e)
+    # >>> x must be int or float, not str
+
+    # methods keep working with zero-argument `super()`
+    class Named:
+        def __init__(self, name):
+            self.name = name
+
+        def describe(self):
+            return self.name
+
+    @fields
+    class Sensor(Named):
+        unit = Field(type=str)
+
+        def __init__(self, name, unit):
+            super().__init__(name)
+            self.unit = unit
+
+        def describe(self):
+            return "{} ({})".format(super().describe(), self.unit)
+
+    print(Sensor("t1", "C").describe())
+    # >>> t1 (C)
+
+    n = 1000000
+    print("{:<22} {:>8} {:>8}".format("", "get", "set"))
+    for cls in (Plain, Slotted, WithProperty, WithDescriptorProperty,
+                WithField, WithTypedField, WithFieldProduction):
+        o = cls(1)  # noqa
+        get = timeit.timeit("o.v", globals=locals(), number=n)
+        set_ = timeit.timeit("o.v = 1", globals=locals(), number=n)
+        print("{:<22} {:>7.3f}s {:>7.3f}s".format(cls.__name__, get, set_))
+    # >>>                             get      set
+    # >>> Plain                    0.012s   0.014s
+    # >>> Slotted                  0.014s   0.015s
+    # >>> WithProperty             0.067s   0.072s
+    # >>> WithDescriptorProperty   0.139s   0.151s
+    # >>> WithField                0.074s   0.075s
+    # >>> WithTypedField           0.068s   0.271s
+    # >>> WithFieldProduction      0.012s   0.013s
+
+    # - reads through a `Field` cost about the same as a `property`, half of
+    #   `DescriptorProperty`
+    # - validated writes pay for the Python-level check
+    # - `validate=False` / `python -O` is a plain slotted attribute
+
+
+if __name__ == '__main__':
+    main()
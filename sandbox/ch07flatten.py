@@ -0,0 +1,204 @@
+# # Flattening Inherited Methods into the Leaf Class
+
+# ch07's `Child1(Root1, Root2)` finds `run1`, `run2` and `shared` by walking
+# `Child1.mro()`; with mixins and 6-10 levels of bases that walk gets long
+
+# `class Foo(Base, metaclass=Flattened)` (or any subclass of a class using
+# it) copies every inherited attribute into the new class's own `__dict__`
+# when the class is created, so an attribute lookup stops at the first
+# class in the MRO
+# - the names that were copied are kept in `cls.__flattened__`
+# - monkey-patching stays correct: setting or deleting an attribute on any
+#   `Flattened` class re-resolves that name in every subclass that holds a
+#   copy of it
+# - a base that doesn't use the metaclass (e.g. a third-party mixin) can't
+#   announce changes; call `refresh(cls)` after patching one of those
+# - attributes from `object` itself are never copied
+
+# note: CPython already caches (type, name) -> attribute in a global method
+# cache, so in a hot loop the MRO walk is mostly skipped anyway; flattening
+# helps most when that cache is cold or thrashed (many types / names, or
+# classes being modified); see the benchmark below
+
+_SKIP = frozenset(("__dict__", "__weakref__", "__module__", "__qualname__",
+                   "__doc__", "__flattened__", "__slots__",
+                   "__abstractmethods__", "_abc_impl"))
+
+
+class Flattened(type):
+    def __init__(cls, name, bases, namespace, **kwargs):
+        super().__init__(name, bases, namespace, **kwargs)
+        type.__setattr__(cls, "__flattened__", set())
+        _flatten(cls)
+
+    def __setattr__(cls, name, value):
+        type.__setattr__(cls, name, value)
+        cls.__flattened__.discard(name)
+        _propagate(cls, name)
+
+    def __delattr__(cls, name):
+        type.__delattr__(cls, name)
+        cls.__flattened__.discard(name)
+        if name in _own_resolution(cls, name, include_self=False):
+            # the name was the class's own and is inherited again now
+            _copy(cls, name)
+        _propagate(cls, name)
+
+
+def _is_own(klass, name):
+    return name in vars(klass) and \
+        name not in getattr(klass, "__flattened__", ())
+
+
+def _own_resolution(cls, name, include_self=True):
+    # {name: value} as the normal MRO walk would find it, skipping copies
+    mro = cls.__mro__ if include_self else cls.__mro__[1:]
+    for klass in mro:
+        if klass is object:
+            break
+        if _is_own(klass, name):
+            return {name: vars(klass)[name]}
+    return {}
+
+
+def _copy(cls, name):
+    found = _own_resolution(cls, name, include_self=False)
+    if name in found:
+        type.__setattr__(cls, name, found[name])
+        cls.__flattened__.add(name)
+
+
+def _flatten(cls):
+    names = set()
+    for klass in cls.__mro__[1:]:
+        if klass is not object:
+            names.update(vars(klass))
+    for name in names - _SKIP:
+        if name not in vars(cls):
+            _copy(cls, name)
+
+
+def _propagate(cls, name):
+    for sub in _all_subclasses(cls):
+        flattened = getattr(sub, "__flattened__", None)
+        if flattened is None or (name in vars(sub) and name not in flattened):
+            continue  # not ours to manage, or `sub` defines its own
+        if name in flattened:
+            type.__delattr__(sub, name)
+            flattened.discard(name)
+        _copy(sub, name)
+
+
+def _all_subclasses(cls):
+    # breadth first, so a subclass is refreshed after its bases
+    result = []
+    queue = list(type.__subclasses__(cls))
+    while queue:
+        sub = queue.pop(0)
+        if sub not in result:
+            result.append(sub)
+            queue.extend(type.__subclasses__(sub))
+    return result
+
+
+def refresh(cls):
+    # re-copy every inherited name, e.g. after patching a plain base class
+    for name in list(cls.__flattened__):
+        type.__delattr__(cls, name)
+    cls.__flattened__.clear()
+    _flatten(cls)
+    for sub in _all_subclasses(cls):
+        if isinstance(sub, Flattened):
+            refresh(sub)
+
+
+# ## Example
+
+
+class Root1:
+    def run1(self):
+        return "hello from root 1"
+
+    def shared(self):
+        return "shared method - root 1"
+
+
+class Root2:
+    def run2(self):
+        return "hello from root 2"
+
+    def shared(self):
+        return "shared method - root 2"
+
+
+class Child1(Root1, Root2, metaclass=Flattened):
+    pass
+
+
+def _deep(metaclass, depth=8):
+    # a chain of `depth` levels, each adding a method, ending in a
+    # `Branch1` / `Branch2` -> `Leaf` diamond
+    base = metaclass("Level0", (), {"method0": lambda self: 0})
+    for i in range(1, depth):
+        base = metaclass("Level{}".format(i), (base,),
+                         {"method{}".format(i): lambda self, i=i: i})
+    branch1 = metaclass("Branch1", (base,), {})
+    branch2 = metaclass("Branch2", (base,), {})
+    return metaclass("Leaf", (branch1, branch2), {})
+
+
+def main():
+    import operator
+    import timeit
+
+    c1 = Child1()
+    print(c1.run1(), "|", c1.run2(), "|", c1.shared())
+    print(sorted(Child1.__flattened__))
+    # >>> hello from root 1 | hello from root 2 | shared method - root 1
+    # >>> ['run1', 'run2', 'shared']
+
+    # patching a Flattened base reaches every copy
+    class Sub(Child1):
+        pass
+
+    Child1.shared = lambda self: "patched"
+    print(Sub().shared())
+    del Child1.shared
+    print(Sub().shared())
+    # >>> patched
+    # >>> shared method - root 1
+
+    # a plain base needs `refresh`
+    Root1.run1 = lambda self: "patched root 1"
+    print(Child1().run1())
+    refresh(Child1)
+    print(Child1().run1())
+    # >>> hello from root 1
+    # >>> patched root 1
+
+    # every attribute of every instance, through one C-level `attrgetter`
+    # call per instance:
+    # - "hot": one hierarchy, so every (type, name) pair stays in the method
+    #   cache
+    # - "thrashed": 500 separate hierarchies x 10 names, more pairs than the
+    #   method cache holds (4096 entries in 3.11)
+    get_all = operator.attrgetter(*("method{}".format(i) for i in range(10)))
+    print("{:<10} {:>8} {:>8}".format("", "plain", "flat"))
+    for label, kinds in (("hot", 1), ("thrashed", 500)):
+        times = []
+        for metaclass in (type, Flattened):
+            leaves = [_deep(metaclass, depth=10) for _ in range(kinds)]
+            objs = [leaves[i % kinds]() for i in range(5000)]
+            times.append(min(timeit.repeat(
+                lambda: list(map(get_all, objs)), number=20, repeat=3)))
+        print("{:<10} {:>7.3f}s {:>7.3f}s".format(label, *times))
+    # >>>               plain     flat
+    # >>> hot          0.087s   0.072s
+    # >>> thrashed     0.265s   0.081s
+
+    # the walk through ~13 classes is what a cache miss costs; flattened
+    # classes find the name in the first `__dict__` they check
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+# # Instance Freelists via `__new__`
+
+# ch07's `NewExample.__new__` shows that `__new__` decides where an instance
+# comes from; it doesn't have to be a fresh allocation
+
+# `Pooled` is a mixin whose `__new__` hands out a recycled instance when one
+# is available:
+# - each class gets its own freelist, capped at `__pool_size__` (default
+#   1024); instances released past the cap are simply dropped
+# - `obj.release()` puts `obj` back; `__init__` runs again on reuse, so it
+#   must set every attribute (override `reset()` to drop references held by
+#   a released instance early)
+# - `Pooled.debug = True` turns on use-after-release detection: a released
+#   instance has its `__class__` swapped to a poisoned twin class whose
+#   attribute access raises `ReleasedError`; releasing twice raises too
+# - freelists are per-class lists; `append` / `pop` are atomic under the
+#   GIL, so threads can share them
+
+# CPython already keeps freelists for some builtins (floats, tuples, ...)
+# and its allocator is fast for small objects, so the gain here is mostly
+# skipping `object.__new__` + deallocation, and fewer allocations counted
+# towards the cyclic collector's gen-0 threshold; see the benchmark
+
+
+class ReleasedError(RuntimeError):
+    pass
+
+
+class Pooled:
+    __slots__ = ()
+    __pool_size__ = 1024
+    debug = False
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if "_Pooled__poisoned" in vars(cls):
+            return  # the poisoned twin itself
+        cls._freelist = []
+        cls._poisoned = type("Released" + cls.__name__, (cls,), {
+            "__slots__": (),
+            "_Pooled__poisoned": True,
+            "__getattribute__": _poisoned_getattribute,
+            "__setattr__": _poisoned_setattr,
+        })
+        cls._poisoned._live_class = cls
+
+    def __new__(cls, *args, **kwargs):
+        freelist = cls._freelist
+        if freelist:
+            obj = freelist.pop()
+            # released under debug (even if debug has been turned off since)
+            if type(obj) is not cls:
+                object.__setattr__(obj, "__class__", cls)
+            return obj
+        return object.__new__(cls)
+
+    def release(self):
+        cls = self.__class__
+        self.reset()
+        if Pooled.debug:
+            object.__setattr__(self, "__class__", cls._poisoned)
+        if len(cls._freelist) < cls.__pool_size__:
+            cls._freelist.append(self)
+
+    def reset(self):
+        pass
+
+    @classmethod
+    def pool_stats(cls):
+        return {"free": len(cls._freelist), "max": cls.__pool_size__}
+
+
+def _poisoned_getattribute(self, name):
+    cls = object.__getattribute__(self, "__class__")
+    if name == "__class__":
+        return cls
+    if name == "release":
+        raise ReleasedError("{} released twice".format(
+            cls._live_class.__name__))
+    raise ReleasedError("{}.{} used after release()".format(
+        cls._live_class.__name__, name))
+
+
+def _poisoned_setattr(self, name, value):
+    cls = object.__getattribute__(self, "__class__")
+    raise ReleasedError("{}.{} set after release()".format(
+        cls._live_class.__name__, name))
+
+
+# ## Example
+
+
+class Message(Pooled):
+    __slots__ = ("topic", "payload", "seq")
+
+    def __init__(self, topic, payload, seq):
+        self.topic = topic
+        self.payload = payload
+        self.seq = seq
+
+    def reset(self):
+        # don't keep the payload alive while sitting in the freelist
+        self.payload = None
+
+
+class PlainMessage:
+    __slots__ = ("topic", "payload", "seq")
+
+    def __init__(self, topic, payload, seq):
+        self.topic = topic
+        self.payload = payload
+        self.seq = seq
+
+
+def main():
+    import gc
+    import time
+
+    m = Message("a", b"x", 1)
+    m.release()
+    m2 = Message("b", b"y", 2)
+    print(m2 is m, m2.topic)
+    # >>> True b
+
+    Pooled.debug = True
+    m2.release()
+    try:
+        m2.topic
+    except ReleasedError as e:
+        print(e)
+    # >>> Message.topic used after release()
+    Pooled.debug = False
+    m3 = Message("c", b"z", 3)  # the poisoned instance, usable again
+    print(m3 is m2, m3.topic)
+    # >>> True c
+
+    # [runs, seconds spent collecting]
+    collections = [0, 0.0]
+    started = [0.0]
+
+    def count(phase, info):
+        if phase == "start":
+            collections[0] += 1
+            started[0] = time.perf_counter()
+        else:
+            collections[1] += time.perf_counter() - started[0]
+
+    gc.callbacks.append(count)
+    try:
+        # 2,000 ticks: each creates a batch of 1,000 messages, holds them
+        # while "processing", then drops (or releases) them
+        for label, cls in (("plain", PlainMessage), ("pooled", Message)):
+            collections[:] = [0, 0.0]
+            start = time.perf_counter()
+            for tick in range(2000):
+                batch = [cls("t", None, i) for i in range(1000)]
+                if cls is Message:
+                    for msg in batch:
+                        msg.release()
+                del batch
+            elapsed = time.perf_counter() - start
+            print("{:<7} {:>5.2f}M msgs/s {:>5} gc runs {:>6.3f}s in gc"
+                  .format(label, 2000000 / elapsed / 1e6, *collections))
+    finally:
+        gc.callbacks.remove(count)
+    # >>> plain    3.67M msgs/s  2000 gc runs  0.078s in gc
+    # >>> pooled   1.86M msgs/s     1 gc runs  0.000s in gc
+
+    # the freelist does what it says on gc pressure: each batch of 1,000
+    # fresh objects crosses the gen-0 threshold (700 allocations), recycled
+    # ones don't allocate at all. but the collections only cost ~2% of the
+    # plain run, and the Python-level `__new__` + `release()` calls cost
+    # far more than CPython's own allocator: pooling pays off only for
+    # objects that are expensive to build (big buffers, caches set up in
+    # `__init__`) or when gc pauses matter more than throughput
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+# # Weak-Value Identity Map
+
+# ch07's `WeakRefExample` keeps a `weakref.ref` to a `Foo`, so the `Foo` can
+# still be collected once nothing else uses it
+
+# the same idea, applied to loading entities from storage:
+# - `IdentityMap(load)` maps primary key -> the live instance for that key,
+#   through a `weakref.WeakValueDictionary`
+# - `get(key)` returns the live instance if there is one (a hit), and only
+#   calls `load(key)` otherwise (a miss); loading the same row twice never
+#   leaves two copies in memory; `load` returning None means "not found":
+#   `get` returns None and `m[key]` raises `KeyError`, caching nothing
+# - entries vanish on their own when the last outside reference goes away
+# - `strong_size=N` adds an LRU tier holding strong references to the N
+#   most recently used objects, so they survive short gaps with no users
+# - `intern(obj)` is the same lookup for an object that's already built:
+#   returns the live instance with the same key, or registers `obj`
+# - `stats()` reports hits, misses, hit rate and live entries
+
+# the values must support weak references (plain classes do; classes with
+# `__slots__` need a `__weakref__` slot)
+
+import collections
+import weakref
+
+
+class IdentityMap:
+    def __init__(self, load=None, key=None, strong_size=0):
+        self.load = load
+        self.key = key
+        self.strong_size = strong_size
+        self._live = weakref.WeakValueDictionary()
+        self._recent = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        obj = self._live.get(key)
+        if obj is None:
+            self.misses += 1
+            obj = self.load(key)
+            if obj is None:
+                # not found in storage; nothing to cache (or weakly
+                # reference)
+                return None
+            self._live[key] = obj
+        else:
+            self.hits += 1
+        self._touch(key, obj)
+        return obj
+
+    def __getitem__(self, key):
+        obj = self.get(key)
+        if obj is None:
+            raise KeyError(key)
+        return obj
+
+    def intern(self, obj):
+        key = self.key(obj)
+        live = self._live.get(key)
+        if live is None:
+            self.misses += 1
+            self._live[key] = live = obj
+        else:
+            self.hits += 1
+        self._touch(key, live)
+        return live
+
+    def peek(self, key):
+        # live instance or None; doesn't load, count, or touch the LRU tier
+        return self._live.get(key)
+
+    def discard(self, key):
+        self._live.pop(key, None)
+        self._recent.pop(key, None)
+
+    def clear(self):
+        self._live.clear()
+        self._recent.clear()
+
+    def __contains__(self, key):
+        return key in self._live
+
+    def __len__(self):
+        return len(self._live)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "live": len(self._live),
+            "strong": len(self._recent),
+        }
+
+    def _touch(self, key, obj):
+        if not self.strong_size:
+            return
+        recent = self._recent
+        if key in recent:
+            recent.move_to_end(key)
+        else:
+            recent[key] = obj
+            if len(recent) > self.strong_size:
+                recent.popitem(last=False)
+
+
+# ## Example
+
+
+class Foo:
+    def __init__(self, id, bar, baz):
+        self.id = id
+        self.bar = bar
+        self.baz = baz
+
+
+def load_foo(id):
+    # stand-in for a database read: a brand new object every time
+    return Foo(id, "bar-{}".format(id), [id] * 4)
+
+
+def main():
+    import gc
+    import random
+    import tracemalloc
+
+    foos = IdentityMap(load_foo, strong_size=2)
+    a = foos.get(1)
+    b = foos.get(1)
+    print(a is b, foos.stats()["hit_rate"])
+    # >>> True 0.5
+
+    # only the strong tier keeps recently used objects alive
+    del a, b
+    for i in range(2, 5):
+        foos.get(i)
+    gc.collect()
+    print(sorted(foos._live.keys()))
+    # >>> [3, 4]
+
+    # workload: 200,000 loads drawn from 5,000 distinct entities, all kept
+    # alive by the caller
+    rnd = random.Random(7)
+    keys = [rnd.randrange(5000) for _ in range(200000)]
+
+    def retained(fetch):
+        tracemalloc.start()
+        try:
+            held = [fetch(k) for k in keys]
+            size = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        del held
+        return size
+
+    without = retained(load_foo)
+    foos = IdentityMap(load_foo)
+    with_map = retained(foos.get)
+    print("without: {:.1f} MB, with: {:.1f} MB ({:.1f} MB saved)".format(
+        without / 1e6, with_map / 1e6, (without - with_map) / 1e6))
+    print(foos.stats())
+    # >>> without: 49.8 MB, with: 3.4 MB (46.4 MB saved)
+    # >>> {'hits': 195000, 'misses': 5000, 'hit_rate': 0.975, 'live': 0,
+    # >>>  'strong': 0}
+
+    # `live` is 0 again: once `held` was dropped, every entry went with it
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+# # Interning Instances with a Metaclass
+
+# chapter03's `Foo.__new__` and ch07's `NewExample.__new__` show that
+# instance creation can be customised; chapter04's `Foo.__eq__` compares
+# two separate objects that hold the same value
+
+# when a few thousand distinct values are repeated across millions of
+# objects, it's cheaper to keep one canonical instance per value:
+# `class Foo(metaclass=Interned)` makes `Foo(42) is Foo(42)`
+# - the metaclass's `__call__` (which is what runs `__new__` and `__init__`)
+#   looks the constructor arguments up first; `__init__` only runs for a new
+#   value
+# - the arguments, together with their types, are the key, so they must be
+#   hashable; keyword arguments and defaults are normalised (`Foo(42)` and
+#   `Foo(value=42)` are the same), but `Foo(1)` and `Foo(1.0)` aren't
+# - the table is a `WeakValueDictionary` per class: a value nobody refers to
+#   anymore is dropped, so the table doesn't grow forever
+# - interned instances are shared: treat them as immutable
+# - `copy.copy` / `copy.deepcopy` return the instance itself
+# - equality: a class's own `__eq__` is wrapped with an identity check, so
+#   the common equal case doesn't call it; distinct instances still go
+#   through it, since unpickled or `__new__`-made ones skip the table; a
+#   class without `__eq__` compares by identity
+# - `Interned.table_size(cls)` reports how many values are live
+
+import functools
+import inspect
+import weakref
+
+
+class Interned(type):
+    def __new__(mcls, name, bases, namespace, **kwargs):
+        slots = namespace.get("__slots__")
+        if slots is not None and "__weakref__" not in slots and \
+                not any(hasattr(b, "__weakref__") for b in bases):
+            slots = (slots,) if isinstance(slots, str) else tuple(slots)
+            namespace["__slots__"] = slots + ("__weakref__",)
+        # shared instances are immutable: a copy is the instance itself
+        namespace.setdefault("__copy__", _same)
+        namespace.setdefault("__deepcopy__", _same)
+        if "__eq__" in namespace:
+            namespace["__eq__"] = _identity_eq(namespace["__eq__"])
+            if "__hash__" not in namespace:
+                # defining __eq__ would otherwise set __hash__ to None
+                namespace["__hash__"] = object.__hash__
+        return super().__new__(mcls, name, bases, namespace, **kwargs)
+
+    def __init__(cls, name, bases, namespace, **kwargs):
+        super().__init__(name, bases, namespace, **kwargs)
+        cls._interned = weakref.WeakValueDictionary()
+        cls._signature = inspect.signature(cls.__init__)
+        params = list(cls._signature.parameters.values())[1:]
+        # number of arguments after `self`, for the positional fast path;
+        # -1 (never matched) when `*args`, `**kwargs` or keyword-only
+        # parameters make a plain positional call ambiguous
+        simple = all(p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)
+                     for p in params)
+        cls._arity = len(params) if simple else -1
+
+    def __call__(cls, *args, **kwargs):
+        if kwargs or len(args) != cls._arity:
+            bound = cls._signature.bind(None, *args, **kwargs)
+            bound.apply_defaults()
+            args = bound.args[1:]
+            kwargs = bound.kwargs
+        # the types too: 1 == 1.0 == True, but they aren't the same value;
+        # one argument is the common case, and building a tuple of types
+        # costs about as much as the whole lookup
+        if len(args) == 1:
+            key = (args, type(args[0]))
+        else:
+            key = (args, tuple([type(a) for a in args]))
+        if kwargs:
+            items = tuple(sorted(kwargs.items()))
+            key += (items, tuple(type(v) for _, v in items))
+        try:
+            return cls._interned[key]
+        except KeyError:
+            pass
+        obj = super().__call__(*args, **kwargs)
+        # another thread may have interned the same value meanwhile
+        return cls._interned.setdefault(key, obj)
+
+    def table_size(cls):
+        return len(cls._interned)
+
+
+def _identity_eq(eq):
+    @functools.wraps(eq)
+    def __eq__(self, other):
+        if self is other:
+            return True
+        return eq(self, other)
+    return __eq__
+
+
+def _same(self, memo=None):
+    return self
+
+
+# ## Example (chapter04's value-holding `Foo`)
+
+
+class Foo:
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+class InternedFoo(metaclass=Interned):
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+class Location(metaclass=Interned):
+    __slots__ = ("country", "city", "timezone")
+
+    def __init__(self, country, city, timezone="UTC"):
+        self.country = country
+        self.city = city
+        self.timezone = timezone
+
+
+class PlainLocation:
+    __slots__ = ("country", "city", "timezone")
+
+    def __init__(self, country, city, timezone="UTC"):
+        self.country = country
+        self.city = city
+        self.timezone = timezone
+
+
+def main():
+    import random
+    import timeit
+    import tracemalloc
+
+    print(InternedFoo(42) is InternedFoo(value=42), Foo(42) is Foo(42))
+    # >>> True False
+    print(Location("FR", "Paris") is Location("FR", "Paris", "UTC"))
+    # >>> True
+
+    # 1M events, each pointing at one of 3,000 locations; the city names are
+    # built per record, as they would be when parsed from input
+    rnd = random.Random(3)
+    places = [("C{}".format(i % 50), "city{}".format(i)) for i in range(3000)]
+    picks = [rnd.randrange(3000) for _ in range(1000000)]
+
+    for cls in (PlainLocation, Location):
+        tracemalloc.start()
+        events = [cls(places[i][0], "".join(places[i][1])) for i in picks]
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print("{:<14} {:>7.1f} MB".format(cls.__name__, size / 1e6))
+        del events
+    # >>> PlainLocation    121.1 MB
+    # >>> Location           9.8 MB
+
+    # what's left for `Location` is mostly the 8 MB list of references: the
+    # 3,000 instances (and their strings) are shared, the per-record city
+    # strings are freed as soon as the lookup hits
+
+    n = 1000000
+    setup = {"a": Foo(3), "b": Foo(4), "c": Foo(3),
+             "ia": InternedFoo(3), "ib": InternedFoo(4), "ic": InternedFoo(3)}
+    for label, stmt in (("Foo ==, equal", "a == c"),
+                        ("Foo ==, unequal", "a == b"),
+                        ("InternedFoo ==, equal", "ia == ic"),
+                        ("InternedFoo ==, unequal", "ia == ib"),
+                        ("Foo(3)", "Foo(3)"),
+                        ("InternedFoo(3)", "InternedFoo(3)")):
+        t = min(timeit.repeat(stmt, globals={**setup, **globals()},
+                              number=n, repeat=3))
+        print("{:<24} {:>6.0f} ns".format(label, t / n * 1e9))
+    # >>> Foo ==, equal                64 ns
+    # >>> Foo ==, unequal              67 ns
+    # >>> InternedFoo ==, equal        58 ns
+    # >>> InternedFoo ==, unequal     105 ns
+    # >>> Foo(3)                      158 ns
+    # >>> InternedFoo(3)              412 ns
+
+    # equal interned values are the same object, so `==` returns before
+    # calling `__eq__`; unequal ones pay for the wrapper plus `__eq__`. the
+    # identity check matters when `__eq__` compares many fields or nested
+    # values. constructing through the table costs about 2.5x a plain
+    # instance (building the typed key included), paid back by not keeping
+    # millions of copies alive
+
+
+if __name__ == '__main__':
+    main()
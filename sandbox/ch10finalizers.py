@@ -0,0 +1,220 @@
+# # Deterministic, Batched Finalization
+
+# ch07's `DelExample.__del__` and ch10's `cleanup()` (an `atexit` hook that
+# calls `gc.collect()`) both leave *when* and *in what order* things get
+# cleaned up to the interpreter, and a full `gc.collect()` over a large heap
+# at exit can take seconds
+
+# `FinalizerRegistry` makes cleanup explicit instead:
+# - `define_kind(name, close=..., close_batch=..., order=...)` says how to
+#   close one kind of resource (files, sockets, ...), and when, relative to
+#   the other kinds
+# - `register(owner, resource, kind)` ties `resource` to the lifetime of
+#   `owner` with `weakref.finalize`; when `owner` is collected, `resource`
+#   isn't closed right away but queued for its kind
+#   - `resource` must not refer back to `owner`, or `owner` never dies
+# - `checkpoint()` closes everything queued, kind by kind, in batches
+# - `close_all()` (also run at exit) closes queued *and* still-owned
+#   resources, then the finalizers are detached so nothing runs twice
+# - `fast_exit(status)` runs the registered buffer flushes, closes
+#   everything, then calls `os._exit`: no interpreter teardown, no
+#   `gc.collect()`, no per-object deallocation
+
+import atexit
+import collections
+import os
+import sys
+import weakref
+
+
+class _Kind:
+    def __init__(self, name, close, close_batch, order):
+        self.name = name
+        self.close = close
+        self.close_batch = close_batch
+        self.order = order
+        self.owned = {}  # token -> finalize
+        self.pending = []  # resources whose owners are gone
+        self.closed = 0
+        self.batches = 0
+
+
+class FinalizerRegistry:
+    def __init__(self, at_exit=True):
+        self._kinds = collections.OrderedDict()
+        self._flushes = []
+        self._next = 0
+        self.errors = []
+        if at_exit:
+            atexit.register(self.close_all)
+
+    def define_kind(self, name, close=None, close_batch=None, order=0):
+        if close is None and close_batch is None:
+            raise ValueError("kind {!r} needs close or close_batch"
+                             .format(name))
+        self._kinds[name] = _Kind(name, close, close_batch, order)
+
+    def register(self, owner, resource, kind):
+        k = self._kinds[kind]
+        self._next += 1
+        token = self._next
+        f = weakref.finalize(owner, self._orphaned, k, token, resource)
+        # the registry decides what happens at exit, not `weakref.finalize`
+        f.atexit = False
+        k.owned[token] = f
+        return f
+
+    def register_flush(self, flush):
+        # e.g. `sys.stdout.flush`, `buffered_writer.flush`;
+        # run first by `fast_exit()`
+        self._flushes.append(flush)
+
+    def checkpoint(self, kinds=None):
+        for k in self._ordered(kinds):
+            pending, k.pending = k.pending, []
+            self._close(k, pending)
+
+    def close_all(self, kinds=None):
+        for k in self._ordered(kinds):
+            owned, k.owned = k.owned, {}
+            for f in owned.values():
+                # detach() hands back (owner, func, args, kwargs) while the
+                # owner is alive and unregisters the finalizer
+                info = f.detach()
+                if info is not None:
+                    k.pending.append(info[2][2])
+            pending, k.pending = k.pending, []
+            self._close(k, pending)
+
+    def flush(self):
+        for flush in self._flushes:
+            try:
+                flush()
+            except Exception as e:
+                self.errors.append(e)
+
+    def fast_exit(self, status=0):
+        self.flush()
+        self.close_all()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(status)
+
+    def stats(self):
+        return {k.name: {"owned": len(k.owned), "pending": len(k.pending),
+                         "closed": k.closed, "batches": k.batches}
+                for k in self._kinds.values()}
+
+    def _orphaned(self, k, token, resource):
+        k.owned.pop(token, None)
+        k.pending.append(resource)
+
+    def _ordered(self, kinds):
+        selected = self._kinds.values() if kinds is None else \
+            [self._kinds[name] for name in kinds]
+        return sorted(selected, key=lambda k: k.order)
+
+    def _close(self, k, resources):
+        if not resources:
+            return
+        k.batches += 1
+        if k.close_batch is not None:
+            try:
+                k.close_batch(resources)
+                k.closed += len(resources)
+            except Exception as e:
+                self.errors.append(e)
+            return
+        for resource in resources:
+            try:
+                k.close(resource)
+                k.closed += 1
+            except Exception as e:
+                self.errors.append(e)
+
+
+# ## Shutdown benchmark
+
+# each mode runs in a child process that builds `n` objects, then exits:
+# - "atexit+gc": ch10's `cleanup()` hook (`gc.collect()`) plus normal exit
+# - "normal": normal interpreter exit
+# - "fast_exit": `FinalizerRegistry.fast_exit()`
+# the time is measured from the child's "exiting" marker until the parent
+# sees the process end
+
+
+def _child(mode, n):
+    import gc
+    import time
+
+    # container objects, so the collector has to visit them; kept in a
+    # global so they live until interpreter teardown
+    global _heap
+    _heap = [[i] for i in range(n)]
+    registry = FinalizerRegistry()
+    registry.define_kind("files", close=lambda f: f.close())
+
+    class Owner:
+        pass
+
+    owner = Owner()
+    out = open(os.devnull, "w")
+    registry.register(owner, out, "files")
+    registry.register_flush(out.flush)
+
+    if mode == "atexit+gc":
+        atexit.register(gc.collect)
+
+    print(time.time(), flush=True)
+    if mode == "fast_exit":
+        registry.fast_exit(0)
+
+
+def main():
+    import subprocess
+    import time
+
+    if len(sys.argv) == 4 and sys.argv[1] == "--child":
+        _child(sys.argv[2], int(sys.argv[3]))
+        return
+
+    # deterministic checkpoints
+    closed = []
+    registry = FinalizerRegistry(at_exit=False)
+    registry.define_kind("sockets", close_batch=closed.extend, order=1)
+    registry.define_kind("files", close=closed.append, order=0)
+
+    class Owner:
+        pass
+
+    a, b = Owner(), Owner()
+    registry.register(a, "file-a", "files")
+    registry.register(b, "socket-b", "sockets")
+    del a  # collected; "file-a" is queued, not closed
+    print(closed, registry.stats()["files"])
+    # >>> [] {'owned': 0, 'pending': 1, 'closed': 0, 'batches': 0}
+    registry.checkpoint()
+    print(closed)
+    # >>> ['file-a']
+    registry.close_all()  # "socket-b" still owned by `b`, closed anyway
+    print(closed)
+    # >>> ['file-a', 'socket-b']
+
+    n = int(os.environ.get("SHUTDOWN_OBJECTS", 10000000))
+    for mode in ("atexit+gc", "normal", "fast_exit"):
+        proc = subprocess.Popen(
+            [sys.executable, __file__, "--child", mode, str(n)],
+            stdout=subprocess.PIPE)
+        marker = float(proc.stdout.readline())
+        proc.wait()
+        print("{:<10} {:.2f}s".format(mode, time.time() - marker))
+    # >>> atexit+gc  3.59s
+    # >>> normal     2.97s
+    # >>> fast_exit  0.06s
+
+    # (10M objects, 1 CPU; the time is almost all deallocation during
+    # interpreter teardown, which `fast_exit` never starts)
+
+
+if __name__ == '__main__':
+    main()